@@ -0,0 +1,150 @@
+# FINGERPRINTED STATIC ASSETS
+# every css/js/icon file is copied to static_build/ under a name that contains a hash of
+# its content (css/main.css -> css/main.1a2b3c4d5e6f.css), together with precompressed
+# .gz and .br variants.
+# templates link to the hashed name through asset_url(), so the url changes whenever the
+# file does, and /assets can tell browsers to keep the file forever (immutable).
+# the compression happens once at build time at maximum level instead of on every request
+#
+# runs at startup, or ahead of time in a deploy step: python -m assets build
+
+import gzip
+import hashlib
+import json
+import shutil
+import stat
+import sys
+from pathlib import Path
+
+import brotli
+from fastapi.staticfiles import StaticFiles
+
+STATIC_DIR = Path("static")
+BUILD_DIR = Path("static_build")
+ASSET_DIRS = ("css", "js", "icons")  # relative to STATIC_DIR
+COMPRESSIBLE = {".css", ".js", ".svg", ".ico", ".json"}  # png/jpg are compressed already
+ASSET_URL_PREFIX = "/assets"
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+# source path -> hashed path, both relative ("js/auth.js" -> "js/auth.0f9e8d7c6b5a.js")
+manifest: dict[str, str] = {}
+
+
+def _write_if_smaller(path: Path, data: bytes, original_size: int) -> None:
+    # a "compressed" variant that isn't smaller is just wasted work for the browser
+    if len(data) < original_size:
+        path.write_bytes(data)
+
+
+def build_assets(source: Path = STATIC_DIR, dest: Path = BUILD_DIR) -> dict[str, str]:
+    """Fingerprint and precompress every asset, write manifest.json and load it."""
+    built = {}
+    for asset_dir in ASSET_DIRS:
+        for path in sorted((source / asset_dir).rglob("*")):
+            if not path.is_file():
+                continue
+            data = path.read_bytes()
+            relative = path.relative_to(source)
+            digest = hashlib.sha256(data).hexdigest()[:12]
+            hashed = relative.with_name(f"{relative.stem}.{digest}{relative.suffix}")
+            built[relative.as_posix()] = hashed.as_posix()
+
+            target = dest / hashed
+            if target.exists():
+                continue  # same name means same content, built by an earlier run
+            target.parent.mkdir(parents=True, exist_ok=True)
+            if relative.suffix in COMPRESSIBLE:
+                # mtime=0 keeps the .gz byte for byte reproducible across builds
+                _write_if_smaller(
+                    target.with_name(target.name + ".gz"),
+                    gzip.compress(data, compresslevel=9, mtime=0),
+                    len(data),
+                )
+                _write_if_smaller(
+                    target.with_name(target.name + ".br"),
+                    brotli.compress(data, quality=11),
+                    len(data),
+                )
+            # the plain file goes last, its presence is what marks the asset as built
+            shutil.copyfile(path, target)
+
+    # older hashed files are kept on purpose: pages cached by browsers still point at them
+    dest.mkdir(parents=True, exist_ok=True)
+    (dest / "manifest.json").write_text(json.dumps(built, indent=2, sort_keys=True))
+    manifest.clear()
+    manifest.update(built)
+    return built
+
+
+def asset_url(path: str) -> str:
+    """Url of the fingerprinted copy of a static file (plain /static url if it wasn't built)."""
+    hashed = manifest.get(path)
+    if hashed is None:
+        return f"/static/{path}"
+    return f"{ASSET_URL_PREFIX}/{hashed}"
+
+
+def asset_import_map() -> dict:
+    """Import map sending the plain /static/js/... module urls to their fingerprinted copies."""
+    # the templates import modules by their plain path and the modules import each other,
+    # the browser rewrites every one of those imports through this map
+    return {
+        "imports": {
+            f"/static/{path}": asset_url(path)
+            for path in manifest
+            if path.endswith(".js")
+        },
+    }
+
+
+def accepted_encodings(accept_encoding: str) -> set[str]:
+    """Parse an Accept-Encoding header into the set of codings the client takes."""
+    accepted = set()
+    for part in accept_encoding.split(","):
+        coding, _, params = part.partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        quality = params.strip()
+        if quality.startswith("q="):
+            try:
+                if float(quality[2:]) == 0:
+                    continue  # q=0 means "not acceptable"
+            except ValueError:
+                continue
+        accepted.add(coding)
+    return accepted
+
+
+class AssetFiles(StaticFiles):
+    """StaticFiles for the fingerprinted build: precompressed variants and immutable caching."""
+
+    ENCODINGS = (("br", ".br"), ("gzip", ".gz"))  # in order of preference
+
+    async def get_response(self, path, scope):
+        headers = dict(scope["headers"])
+        accepted = accepted_encodings(headers.get(b"accept-encoding", b"").decode("latin-1"))
+        for coding, suffix in self.ENCODINGS:
+            if coding not in accepted:
+                continue
+            full_path, stat_result = self.lookup_path(path + suffix)
+            if stat_result is not None and stat.S_ISREG(stat_result.st_mode):
+                # FileResponse guesses the content type from the name, "main.abc.css.br"
+                # still comes out as text/css
+                response = self.file_response(full_path, stat_result, scope)
+                response.headers["Content-Encoding"] = coding
+                break
+        else:
+            response = await super().get_response(path, scope)
+
+        if response.status_code in (200, 304):
+            response.headers["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+            response.headers["Vary"] = "Accept-Encoding"
+        return response
+
+
+if __name__ == "__main__":
+    # python -m assets build
+    if sys.argv[1:] != ["build"]:
+        sys.exit("usage: python -m assets build")
+    print(f"built {len(build_assets())} assets into {BUILD_DIR}/")
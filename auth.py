@@ -1,3 +1,7 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from datetime import UTC, datetime, timedelta
 
 import jwt
@@ -11,8 +15,11 @@ from fastapi import Depends, HTTPException, status
 
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
+import deletion
 import models
-from database import get_db
+from cache import token_cache, user_cache
+from database import get_read_db
+from schemas import UserPrivate
 
 password_hash = PasswordHash.recommended()  # creates a password hasher using the recommended algorithm (bcrypt)
 
@@ -30,6 +37,91 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
     )  # verifies the plain password against the hashed password
 
 
+# ARGON2 IS SLOW ON PURPOSE (tens of ms of pure CPU per call), calling it directly inside an
+# async route freezes the event loop and every other request waits behind the login.
+# so the async routes go through a small thread pool instead (argon2-cffi releases the GIL
+# while hashing, so threads really run in parallel). concurrency is capped at the number of
+# workers and only a bounded number of requests may queue up, past that we shed load with 503
+
+
+@dataclass
+class PasswordHashStats:
+    completed: int = 0  # hashes/verifications that returned a result
+    failed: int = 0  # raised inside the worker (a malformed stored hash, for one)
+    rejected: int = 0  # shed with 503 because the queue was full, never reached a worker
+    hash_seconds_total: float = 0.0  # time spent inside argon2
+    wait_seconds_total: float = 0.0  # time spent waiting for a free worker
+
+
+class PasswordHashPool:
+    """Run password hashing off the event loop with bounded concurrency and queue depth."""
+
+    def __init__(self, workers: int, max_queue: int):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.in_flight = 0
+        self.queued = 0
+        self.stats = PasswordHashStats()
+        self._slots = asyncio.Semaphore(workers)
+        self._executor: ThreadPoolExecutor | None = None  # created on first use
+
+    async def run(self, func, *args):
+        if self.in_flight >= self.workers and self.queued >= self.max_queue:
+            self.stats.rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Server is busy, please try again",
+                headers={"Retry-After": "1"},
+            )
+
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.workers,
+                thread_name_prefix="password-hash",
+            )
+
+        queued_at = time.perf_counter()
+        self.queued += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self.queued -= 1
+
+        started_at = time.perf_counter()
+        self.stats.wait_seconds_total += started_at - queued_at
+        self.in_flight += 1
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+        except Exception:
+            self.stats.failed += 1
+            raise
+        finally:
+            self.in_flight -= 1
+            self._slots.release()
+            self.stats.hash_seconds_total += time.perf_counter() - started_at
+        self.stats.completed += 1
+        return result
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+
+password_hash_pool = PasswordHashPool(
+    workers=settings.password_hash_workers,
+    max_queue=settings.password_hash_max_queue,
+)
+
+
+async def hash_password_async(password: str) -> str:
+    return await password_hash_pool.run(hash_password, password)
+
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    return await password_hash_pool.run(verify_password, plain_password, hashed_password)
+
+
 # ENCRYPTION REVERSIBLE. HASHING ISNT. ARGON2 CREATES RANDOM SEED FOR EACH HASH. PREVENTS HACKERS FROM USING RAINBOW TABLES TO CRACK HASHES.
 # BCRYPT ALSO USES SALTING AND IS SLOW BY DESIGN, MAKING IT RESISTANT TO BRUTE-FORCE ATTACKS. BOTH ARE GOOD CHOICES FOR PASSWORD HASHING,
 # WITH ARGON2 BEING THE MORE MODERN AND SECURE OPTION.
@@ -59,6 +151,10 @@ def create_access_token(data: dict, expires_delta: timedelta | None = None) -> s
 
 def verify_access_token(token: str) -> str | None:
     """Verify a JWT access token and return the subject (user id) if valid."""
+    subject = token_cache.get(token)
+    if subject is not None:
+        return subject  # already verified, skip the signature check
+
     try:
         payload = jwt.decode(
             token,
@@ -69,7 +165,10 @@ def verify_access_token(token: str) -> str | None:
     except jwt.InvalidTokenError:
         return None
     else:
-        return payload.get("sub")
+        subject = payload.get("sub")
+        # cache only until the token itself expires, after that it has to fail like before
+        token_cache.set(token, subject, ttl_seconds=payload["exp"] - time.time())
+        return subject
 
 
 # JWT STRUCTURE
@@ -81,10 +180,18 @@ def verify_access_token(token: str) -> str | None:
 # PAYLOAD: {"sub": "user_id", "exp": "expiration_time"}
 # SIGNATURE: HMACSHA256(base64UrlEncode(header) + "." + base64UrlEncode(payload))
 
+def user_not_found() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="User not found",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+
+
 async def get_current_user(
     token: Annotated[str, Depends(oauth2_scheme)],
-    db: Annotated[AsyncSession, Depends(get_db)],
-) -> models.User:
+    db: Annotated[AsyncSession, Depends(get_read_db)],
+) -> UserPrivate:
     user_id = verify_access_token(token)
     if user_id is None:
         raise HTTPException(
@@ -102,15 +209,28 @@ async def get_current_user(
             headers={"WWW-Authenticate": "Bearer"},
         )
 
-    result = await db.execute(
-        select(models.User).where(models.User.id == user_id_int),
-    )
-    user = result.scalars().first() #fuk does scalars do again?
-    if not user:
+    if user_id_int in deletion.in_progress:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="User not found",
+            detail="Account is being deleted",
             headers={"WWW-Authenticate": "Bearer"},
         )
+
+    user = user_cache.get(user_id_int)
+    if user is not None:
+        return user  # no database round trip on the hot path, see cache.user_cache
+
+    stamp = user_cache.stamp()
+    result = await db.execute(
+        select(models.User).where(models.User.id == user_id_int),
+    )
+    db_user = result.scalars().first() #fuk does scalars do again?
+    if not db_user:
+        raise user_not_found()
+
+    # cache a detached pydantic snapshot rather than the ORM object,
+    # it can't be lazy loaded or accidentally attached to another session
+    user = UserPrivate.model_validate(db_user)
+    user_cache.set(user_id_int, user, stamp=stamp)
     return user
-Current_User = Annotated[models.User, Depends(get_current_user)]
+Current_User = Annotated[UserPrivate, Depends(get_current_user)]
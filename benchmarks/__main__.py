@@ -0,0 +1,82 @@
+# python -m benchmarks run [--users 200 --posts 20000 --requests 500 --concurrency 8]
+# python -m benchmarks compare old.json new.json [--threshold 10]
+#
+# run seeds a throwaway SQLite file in a temporary directory, never the real blog.db
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+RESULTS_DIR = Path("benchmarks/results")
+
+
+def _run(args) -> None:
+    with tempfile.TemporaryDirectory(prefix="blog-bench-") as tmp:
+        # has to happen before the app modules are imported, they read the settings on import
+        os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{tmp}/bench.db"
+        os.environ["PROFILE_DIR"] = f"{tmp}/profiles"
+        os.environ.setdefault("SECRET_KEY", "benchmark-only-secret-key-not-for-production")
+        # every benchmark request comes from the same client, the login scenario would
+        # otherwise measure the throttle instead of the login
+        os.environ["LOGIN_IP_BURST"] = os.environ["LOGIN_EMAIL_BURST"] = "1000000"
+
+        from benchmarks.runner import run_benchmarks, save_results
+
+        results = asyncio.run(run_benchmarks(
+            users=args.users,
+            posts=args.posts,
+            requests=args.requests,
+            concurrency=args.concurrency,
+            warmup=args.warmup,
+            seed=args.seed,
+            only=set(args.only) if args.only else None,
+        ))
+
+    out = args.out or RESULTS_DIR / f"{results['meta']['date'].replace(':', '')}-{results['meta']['commit'] or 'nogit'}.json"
+    save_results(results, Path(out))
+    print(f"results written to {out}")
+
+
+def _compare(args) -> None:
+    # only reads two JSON files, doesn't need the app (or its settings)
+    from benchmarks.runner import compare_results
+
+    old = json.loads(Path(args.old).read_text())
+    new = json.loads(Path(args.new).read_text())
+    lines, regressed = compare_results(old, new, args.threshold)
+    print("\n".join(lines))
+    if regressed:
+        sys.exit(f"regression over {args.threshold}% (marked with !)")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="seed a temporary database and run the scenarios")
+    run.add_argument("--users", type=int, default=200)
+    run.add_argument("--posts", type=int, default=20_000)
+    run.add_argument("--requests", type=int, default=500, help="requests per scenario (scaled down for the slow ones)")
+    run.add_argument("--concurrency", type=int, default=8)
+    run.add_argument("--warmup", type=int, default=20)
+    run.add_argument("--seed", type=int, default=42)
+    run.add_argument("--only", nargs="*", help="scenario names to run, all by default")
+    run.add_argument("--out", help="results file, default benchmarks/results/<date>-<commit>.json")
+    run.set_defaults(handler=_run)
+
+    compare = commands.add_parser("compare", help="compare two results files")
+    compare.add_argument("old")
+    compare.add_argument("new")
+    compare.add_argument("--threshold", type=float, default=10.0, help="percent change that counts as a regression")
+    compare.set_defaults(handler=_compare)
+
+    args = parser.parse_args()
+    args.handler(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+# BENCHMARK RUNNER
+# seeds the database, starts the app (lifespan included) and runs every scenario with a
+# fixed number of concurrent clients, then reports throughput and latency percentiles.
+# the results are plain JSON: keep one per commit and diff them with compare_results
+
+import asyncio
+import json
+import platform
+import random
+import subprocess
+import time
+from datetime import UTC, datetime
+from pathlib import Path
+
+import httpx
+
+import main
+from benchmarks.scenarios import SCENARIOS, Context, prepare
+from benchmarks.seed import seed_database
+
+
+def percentile(sorted_values: list[float], pct: float) -> float:
+    """Nearest rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, round(pct / 100 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+async def _run_scenario(client, scenario, ctx, requests: int, concurrency: int, warmup: int) -> dict:
+    for _ in range(warmup):
+        await scenario.run(client, ctx)
+
+    latencies = []
+    errors = 0
+    remaining = requests
+
+    async def worker():
+        nonlocal remaining, errors
+        while remaining > 0:
+            remaining -= 1
+            started = time.perf_counter()
+            response = await scenario.run(client, ctx)
+            latencies.append(time.perf_counter() - started)
+            if response.status_code >= 400:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "route": scenario.route,
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput_rps": round(len(latencies) / elapsed, 1),
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 3),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+    }
+
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run_benchmarks(
+    users: int,
+    posts: int,
+    requests: int,
+    concurrency: int,
+    warmup: int,
+    seed: int,
+    only: set[str] | None = None,
+) -> dict:
+    """Seed, run the selected scenarios (all by default) and return the results document."""
+    started = time.perf_counter()
+    await seed_database(users, posts, seed)
+    seed_seconds = time.perf_counter() - started
+
+    ctx = Context(users=users, posts=posts, rng=random.Random(seed))
+    results = {}
+    async with main.app.router.lifespan_context(main.app):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            await prepare(client, ctx)
+            for scenario in SCENARIOS:
+                if only and scenario.name not in only:
+                    continue
+                count = max(1, int(requests * scenario.weight))
+                results[scenario.name] = await _run_scenario(
+                    client, scenario, ctx, count, concurrency, min(warmup, count),
+                )
+                print(_format_row(scenario.name, results[scenario.name]))
+
+    return {
+        "meta": {
+            "commit": _git_commit(),
+            "date": datetime.now(UTC).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "users": users,
+            "posts": posts,
+            "requests": requests,
+            "concurrency": concurrency,
+            "seed": seed,
+            "seed_seconds": round(seed_seconds, 2),
+        },
+        "scenarios": results,
+    }
+
+
+def _format_row(name: str, result: dict) -> str:
+    return (
+        f"{name:<16} {result['throughput_rps']:>9.1f} req/s   "
+        f"p50 {result['p50_ms']:>8.2f} ms   p95 {result['p95_ms']:>8.2f} ms   "
+        f"p99 {result['p99_ms']:>8.2f} ms   errors {result['errors']}"
+    )
+
+
+def save_results(results: dict, path: Path) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(results, indent=2) + "\n")
+
+
+COMPARED = (("throughput_rps", True), ("p50_ms", False), ("p95_ms", False), ("p99_ms", False))  # (key, higher is better)
+
+
+def compare_results(old: dict, new: dict, threshold_pct: float) -> tuple[list[str], bool]:
+    """Lines of a side by side report, and whether anything regressed by more than threshold_pct."""
+    lines = [f"old: {old['meta'].get('commit')}  new: {new['meta'].get('commit')}"]
+    regressed = False
+    for name, new_result in new["scenarios"].items():
+        old_result = old["scenarios"].get(name)
+        if old_result is None:
+            lines.append(f"{name:<16} (new scenario)")
+            continue
+        cells = []
+        for key, higher_is_better in COMPARED:
+            before, after = old_result[key], new_result[key]
+            change = (after - before) / before * 100 if before else 0.0
+            worse = -change if higher_is_better else change
+            flag = ""
+            if worse > threshold_pct:
+                flag = " !"
+                regressed = True
+            cells.append(f"{key} {before:.2f} -> {after:.2f} ({change:+.1f}%){flag}")
+        lines.append(f"{name:<16} " + "   ".join(cells))
+    return lines, regressed
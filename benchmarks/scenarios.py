@@ -0,0 +1,121 @@
+# BENCHMARK SCENARIOS
+# each scenario is one kind of request against the app, run in-process through httpx's
+# ASGI transport: no sockets and no uvicorn, so the numbers are the app's own cost
+# (routing, dependencies, SQL, rendering, middleware) and they don't depend on the network.
+# a scenario picks its ids from a seeded random generator, so runs are repeatable
+
+import random
+from dataclasses import dataclass
+from typing import Awaitable, Callable
+
+import httpx
+
+from benchmarks.seed import BENCH_PASSWORD
+
+
+@dataclass
+class Context:
+    users: int
+    posts: int
+    rng: random.Random
+    token: str = ""  # access token of user1, set up before the authenticated scenarios
+    own_post_ids: tuple[int, ...] = ()  # posts written by user1, for the update scenario
+
+    @property
+    def auth(self) -> dict[str, str]:
+        return {"Authorization": f"Bearer {self.token}"}
+
+    def post_id(self) -> int:
+        return self.rng.randint(1, self.posts)
+
+    def user_id(self) -> int:
+        return self.rng.randint(1, self.users)
+
+
+@dataclass
+class Scenario:
+    name: str
+    route: str  # the route template it exercises, for the report
+    run: Callable[[httpx.AsyncClient, Context], Awaitable[httpx.Response]]
+    weight: float = 1.0  # fraction of --requests to run, login is slow on purpose (argon2)
+
+
+async def _feed(client, ctx):
+    return await client.get("/api/posts", params={"limit": 20})
+
+
+async def _home(client, ctx):
+    return await client.get("/")
+
+
+async def _single_post(client, ctx):
+    return await client.get(f"/api/posts/{ctx.post_id()}")
+
+
+async def _post_page(client, ctx):
+    return await client.get(f"/posts/{ctx.post_id()}")
+
+
+async def _user_posts(client, ctx):
+    return await client.get(f"/api/users/{ctx.user_id()}/posts", params={"limit": 20})
+
+
+async def _user_posts_page(client, ctx):
+    return await client.get(f"/users/{ctx.user_id()}/posts")
+
+
+async def _login(client, ctx):
+    user_id = ctx.user_id()
+    return await client.post(
+        "/api/users/token",
+        data={"username": f"user{user_id}@bench.example", "password": BENCH_PASSWORD},
+    )
+
+
+async def _create_post(client, ctx):
+    return await client.post(
+        "/api/posts",
+        json={"title": "Benchmark post", "content": "benchmark content " * ctx.rng.randint(10, 200)},
+        headers=ctx.auth,
+    )
+
+
+async def _update_post(client, ctx):
+    post_id = ctx.rng.choice(ctx.own_post_ids)
+    return await client.patch(
+        f"/api/posts/{post_id}",
+        json={"content": "updated content " * ctx.rng.randint(10, 200)},
+        headers=ctx.auth,
+    )
+
+
+SCENARIOS = (
+    Scenario("feed", "GET /api/posts", _feed),
+    Scenario("home", "GET /", _home),
+    Scenario("single_post", "GET /api/posts/{post_id}", _single_post),
+    Scenario("post_page", "GET /posts/{post_id}", _post_page),
+    Scenario("user_posts", "GET /api/users/{user_id}/posts", _user_posts),
+    Scenario("user_posts_page", "GET /users/{user_id}/posts", _user_posts_page),
+    Scenario("login", "POST /api/users/token", _login, weight=0.05),
+    Scenario("create_post", "POST /api/posts", _create_post, weight=0.5),
+    Scenario("update_post", "PATCH /api/posts/{post_id}", _update_post, weight=0.5),
+)
+
+
+async def prepare(client: httpx.AsyncClient, ctx: Context) -> None:
+    """Log in as user1 and find its posts, for the authenticated scenarios."""
+    response = await client.post(
+        "/api/users/token",
+        data={"username": "user1@bench.example", "password": BENCH_PASSWORD},
+    )
+    response.raise_for_status()
+    ctx.token = response.json()["access_token"]
+
+    response = await client.get("/api/users/1/posts", params={"limit": 100, "fields": "id"})
+    response.raise_for_status()
+    ctx.own_post_ids = tuple(post["id"] for post in response.json()["posts"])
+    if not ctx.own_post_ids:
+        # user1 drew no posts in the seed, give it one so there is something to update
+        response = await client.post("/api/posts", json={"title": "Mine", "content": "mine"}, headers=ctx.auth)
+        response.raise_for_status()
+        ctx.own_post_ids = (response.json()["id"],)
@@ -0,0 +1,79 @@
+# SEED DATA FOR THE BENCHMARKS
+# N users and M posts with a fixed random seed, so two runs (or two commits) benchmark the
+# exact same database. content lengths follow a log-normal distribution, a lot of short
+# posts and a long tail of long ones, like a real blog.
+# everything goes in through Core bulk inserts, the whole seed takes seconds, not minutes.
+# importing this (or anything from the app) reads the settings, so DATABASE_URL has to point
+# at the benchmark database before that, python -m benchmarks takes care of it
+
+import random
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import insert
+
+import models
+from auth import hash_password
+from database import engine
+from migrations import upgrade_database
+from stats import repair_user_stats
+
+BENCH_PASSWORD = "benchmark-password"
+BASE_DATE = datetime(2025, 1, 1, tzinfo=timezone.utc)  # fixed, so the feeds order the same on every run
+
+WORDS = (
+    "async database query index cache page feed post user latency python fastapi sqlite "
+    "request response server client token session stream render template search write read "
+    "the a of and to in is it that for on with as this was at by from be are have not"
+).split()
+
+
+def _text(rng: random.Random, length: int) -> str:
+    words = []
+    size = 0
+    while size < length:
+        word = rng.choice(WORDS)
+        words.append(word)
+        size += len(word) + 1
+    return " ".join(words)[:length]
+
+
+def _content_length(rng: random.Random) -> int:
+    # median ~1200 characters, 1% of posts over ~12k
+    return max(40, min(20_000, int(rng.lognormvariate(7.1, 1.0))))
+
+
+def build_rows(users: int, posts: int, seed: int, password_hash: str) -> tuple[list[dict], list[dict]]:
+    """Generate the user and post rows, same arguments -> same rows."""
+    rng = random.Random(seed)
+    user_rows = [
+        {
+            "id": user_id,
+            "username": f"user{user_id}",
+            "email": f"user{user_id}@bench.example",
+            "password_hash": password_hash,
+        }
+        for user_id in range(1, users + 1)
+    ]
+    post_rows = []
+    for post_id in range(1, posts + 1):
+        post_rows.append({
+            "id": post_id,
+            "title": _text(rng, rng.randint(15, 90)).capitalize(),
+            "content": _text(rng, _content_length(rng)),
+            "user_id": rng.randint(1, users),
+            "date_posted": BASE_DATE + timedelta(seconds=rng.randint(0, 2 * 365 * 86_400)),
+        })
+    return user_rows, post_rows
+
+
+async def seed_database(users: int, posts: int, seed: int = 42, batch_size: int = 5_000) -> None:
+    """Create the schema on the configured database and fill it."""
+    # every seeded user shares one password, hashing argon2 once per user would dominate the seed
+    user_rows, post_rows = build_rows(users, posts, seed, hash_password(BENCH_PASSWORD))
+
+    await upgrade_database(engine)  # the same schema the app runs on, search index and all
+    async with engine.begin() as conn:
+        await conn.execute(insert(models.User.__table__), user_rows)
+        for start in range(0, len(post_rows), batch_size):
+            await conn.execute(insert(models.Post.__table__), post_rows[start:start + batch_size])
+        await conn.run_sync(repair_user_stats)  # post_count / last_posted_at / total_chars
@@ -0,0 +1,182 @@
+# IN-PROCESS CACHES
+# a small bounded LRU cache with TTLs, used to keep hot read paths away from SQLite
+# everything here runs on the event loop thread and never awaits, so no locks are needed
+# (the cache is per process, every uvicorn worker has its own copy)
+
+import time
+from collections import OrderedDict
+from datetime import UTC, datetime, timedelta
+from dataclasses import dataclass, field
+from typing import Any, Hashable
+
+from config import settings
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0  # entries pushed out because the cache was full
+    expirations: int = 0  # entries dropped because their TTL ran out
+    invalidations: int = 0  # entries dropped because the underlying data was written
+
+
+@dataclass
+class _Entry:
+    value: Any
+    expires_at: float
+    tags: tuple[Hashable, ...] = field(default_factory=tuple)
+
+
+class LRUCache:
+    """Bounded LRU cache with per-entry TTL and tag based invalidation."""
+
+    def __init__(self, name: str, max_size: int, ttl_seconds: float):
+        self.name = name
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.stats = CacheStats()
+        self._entries: OrderedDict[Hashable, _Entry] = OrderedDict()
+        self._tags: dict[Hashable, set[Hashable]] = {}  # tag -> keys carrying that tag
+        self._generation = 0  # bumped on every invalidation, see stamp()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Any | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.stats.misses += 1
+            return None
+
+        if entry.expires_at <= time.monotonic():
+            self._remove(key)
+            self.stats.expirations += 1
+            self.stats.misses += 1
+            return None
+
+        self._entries.move_to_end(key)  # most recently used goes to the back
+        self.stats.hits += 1
+        return entry.value
+
+    def stamp(self) -> int:
+        """Take a stamp before reading from the database, pass it to set() afterwards."""
+        return self._generation
+
+    def set(
+        self,
+        key: Hashable,
+        value: Any,
+        *,
+        tags: tuple[Hashable, ...] = (),
+        ttl_seconds: float | None = None,
+        stamp: int | None = None,
+    ) -> None:
+        # if anything was invalidated while we were awaiting the database, the value we
+        # are holding might already be stale, so skip caching it this time around
+        if stamp is not None and stamp != self._generation:
+            return
+
+        if self.max_size <= 0:
+            return
+
+        if key in self._entries:
+            self._remove(key)
+
+        ttl = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+        self._entries[key] = _Entry(value, time.monotonic() + ttl, tags)
+        for tag in tags:
+            self._tags.setdefault(tag, set()).add(key)
+
+        while len(self._entries) > self.max_size:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.stats.evictions += 1
+
+    def invalidate(self, key: Hashable) -> None:
+        self._generation += 1
+        if key in self._entries:
+            self._remove(key)
+            self.stats.invalidations += 1
+
+    def invalidate_tag(self, tag: Hashable) -> None:
+        self._generation += 1
+        for key in list(self._tags.get(tag, ())):
+            self._remove(key)
+            self.stats.invalidations += 1
+
+    def clear(self) -> None:
+        self._generation += 1
+        self.stats.invalidations += len(self._entries)
+        self._entries.clear()
+        self._tags.clear()
+
+    def _remove(self, key: Hashable) -> None:
+        entry = self._entries.pop(key)
+        for tag in entry.tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+
+# serialized PostResponse JSON keyed by post id, tagged with ("author", user_id)
+# so a username or picture change drops every cached post by that author
+post_cache = LRUCache(
+    "post",
+    max_size=settings.post_cache_size,
+    ttl_seconds=settings.post_cache_ttl_seconds,
+)
+
+
+# rendered html pages keyed by the full request url (host and query string included,
+# url_for builds absolute urls so the host ends up in the html)
+page_cache = LRUCache(
+    "page",
+    max_size=settings.page_cache_size,
+    ttl_seconds=settings.page_cache_ttl_seconds,
+)
+
+content_version = 0  # bumped by every post/user write, see bump_content_version
+# when content_version last changed, the Last-Modified of the cached pages. whole seconds
+# (that's all an http date has) and strictly increasing, so two writes in the same second
+# still give different dates. starts at process start, we don't know what happened before
+content_modified_at = datetime.now(UTC).replace(microsecond=0)
+
+
+def bump_content_version() -> None:
+    """Mark all rendered pages as stale, called by every post and user write path."""
+    global content_version, content_modified_at
+    content_version += 1
+    content_modified_at = max(
+        datetime.now(UTC).replace(microsecond=0), content_modified_at + timedelta(seconds=1),
+    )
+    page_cache.clear()
+
+
+# verified access token -> subject (user id), each entry expires together with the token
+token_cache = LRUCache(
+    "token",
+    max_size=settings.token_cache_size,
+    ttl_seconds=settings.access_token_expire_minutes * 60,
+)
+
+# user id -> UserPrivate snapshot for auth.get_current_user
+# update_user and delete_user invalidate it in the process that handled them. the other
+# workers keep their copy until the ttl runs out: for up to user_cache_ttl_seconds they show
+# an old username or picture (/api/users/me) and still let a deleted account through. that
+# only reaches its own data, which went with the user row (ON DELETE CASCADE): reads find
+# nothing, edits get a 404 and new posts fail the posts.user_id foreign key, which the
+# post routes answer with 401 (user_not_found) instead of a 500
+user_cache = LRUCache(
+    "user",
+    max_size=settings.user_cache_size,
+    ttl_seconds=settings.user_cache_ttl_seconds,
+)
+
+
+def invalidate_author(user_id: int) -> None:
+    """Drop everything that embeds a user's public profile (name, picture, post stats)."""
+    user_cache.invalidate(user_id)
+    post_cache.invalidate_tag(("author", user_id))
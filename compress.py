@@ -0,0 +1,203 @@
+# RESPONSE COMPRESSION
+# feed pages and html are mostly repeated keys and markup, they shrink 5-10x. this ASGI
+# middleware negotiates the best coding the client accepts (br > zstd > gzip; zstd comes
+# from the standard library on 3.14+, from zstandard before that) and compresses the body
+# as it streams out, so exports never get buffered whole.
+# skipped: small bodies (the headers and the CPU cost more than the bytes saved), responses
+# that already carry a Content-Encoding (/assets sends precompressed files), media types
+# that are compressed already (jpg/png uploads, icons) and range responses (their
+# Content-Range counts bytes of the uncompressed file, a compressed body wouldn't match).
+# per route stats (bytes in/out, CPU time) are kept to tune compression_minimum_size.
+# a response sent with "X-Accel-Buffering: no" (the streamed html pages) wants its chunks
+# to reach the client as they're produced, so each one is flushed out of the compressor
+# instead of waiting for the compressor's own buffer to fill up
+
+import time
+import zlib
+from collections import defaultdict
+from dataclasses import dataclass
+
+import brotli
+from starlette.datastructures import Headers, MutableHeaders
+
+from assets import accepted_encodings
+from config import settings
+from metrics import route_label
+
+try:
+    from compression import zstd  # standard library from Python 3.14
+except ImportError:
+    import zstandard as zstd  # a dependency on older Pythons, see pyproject.toml
+
+# only these get compressed, everything else (images, archives, octet-stream...) passes through
+COMPRESSIBLE_TYPES = (
+    "text/",
+    "application/json",
+    "application/x-ndjson",
+    "application/javascript",
+    "application/xml",
+    "application/atom+xml",
+    "image/svg+xml",
+)
+
+
+class _BrotliCompressor:
+    # brotli's streaming api is process()/finish(), this gives it the zlib shape
+    def __init__(self):
+        self._compressor = brotli.Compressor(quality=settings.compression_brotli_quality)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.process(data)
+
+    def flush(self) -> bytes:
+        return self._compressor.finish()
+
+    def flush_block(self) -> bytes:
+        return self._compressor.flush()
+
+
+def _brotli_flush_block(compressor) -> bytes:
+    return compressor.flush_block()
+
+
+def _zstd_compressor():
+    if hasattr(zstd, "ZstdCompressor") and hasattr(zstd.ZstdCompressor, "compressobj"):
+        return zstd.ZstdCompressor(level=settings.compression_zstd_level).compressobj()  # zstandard
+    return zstd.ZstdCompressor(level=settings.compression_zstd_level)  # compression.zstd
+
+
+def _zstd_flush_block(compressor) -> bytes:
+    if hasattr(zstd, "COMPRESSOBJ_FLUSH_BLOCK"):
+        return compressor.flush(zstd.COMPRESSOBJ_FLUSH_BLOCK)  # zstandard
+    return compressor.flush(zstd.ZstdCompressor.FLUSH_BLOCK)  # compression.zstd
+
+
+def _gzip_compressor():
+    # wbits=31 -> gzip container instead of a raw zlib stream
+    return zlib.compressobj(settings.compression_gzip_level, zlib.DEFLATED, 31)
+
+
+def _gzip_flush_block(compressor) -> bytes:
+    return compressor.flush(zlib.Z_SYNC_FLUSH)
+
+
+# (coding, compressor factory, flush_block function), in order of preference
+CODINGS = [
+    ("br", _BrotliCompressor, _brotli_flush_block),
+    ("zstd", _zstd_compressor, _zstd_flush_block),
+    ("gzip", _gzip_compressor, _gzip_flush_block),
+]
+
+
+@dataclass
+class CompressionStats:
+    compressed: int = 0  # responses compressed
+    skipped_small: int = 0  # compressible responses below the size threshold
+    bytes_in: int = 0
+    bytes_out: int = 0
+    cpu_seconds: float = 0.0  # time spent inside the compressor
+
+    @property
+    def ratio(self) -> float:
+        """Compressed size / original size, lower is better."""
+        return self.bytes_out / self.bytes_in if self.bytes_in else 1.0
+
+
+# route path template ("/api/posts/{post_id}") -> stats
+route_stats: defaultdict[str, CompressionStats] = defaultdict(CompressionStats)
+
+
+def _is_compressible(headers: Headers) -> bool:
+    if "content-encoding" in headers or "content-range" in headers:
+        return False
+    if "no-transform" in headers.get("cache-control", ""):
+        return False
+    content_type = headers.get("content-type", "")
+    return content_type.startswith(COMPRESSIBLE_TYPES)
+
+
+class CompressionMiddleware:
+    def __init__(self, app, minimum_size: int = 1024):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] == "HEAD":
+            await self.app(scope, receive, send)
+            return
+
+        accepted = accepted_encodings(Headers(scope=scope).get("accept-encoding", ""))
+        for coding, factory, flush_block in CODINGS:
+            if coding in accepted:
+                break
+        else:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+        compressor = None  # None until we decided to compress, False when we decided not to
+        stats = None
+        flush_chunks = False
+
+        async def send_compressed(message):
+            nonlocal start_message, compressor, stats, flush_chunks
+
+            if message["type"] == "http.response.start":
+                start_message = message
+                headers = Headers(raw=message["headers"])
+                if message["status"] in (204, 206, 304) or not _is_compressible(headers):
+                    compressor = False
+                    await send(message)
+                    return
+                flush_chunks = headers.get("x-accel-buffering") == "no"
+                content_length = headers.get("content-length")
+                if content_length is not None and int(content_length) < self.minimum_size:
+                    compressor = False
+                    route_stats[route_label(scope)].skipped_small += 1
+                    await send(message)
+                # otherwise hold the start message until we see the first chunk of body
+                return
+
+            if message["type"] != "http.response.body" or compressor is False:
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+
+            if compressor is None:
+                if not more_body and len(body) < self.minimum_size:
+                    # a small body without a Content-Length (rare), send it as it is
+                    compressor = False
+                    route_stats[route_label(scope)].skipped_small += 1
+                    await send(start_message)
+                    await send(message)
+                    return
+
+                compressor = factory()
+                stats = route_stats[route_label(scope)]
+                stats.compressed += 1
+                headers = MutableHeaders(raw=start_message["headers"])
+                del headers["content-length"]  # unknown until the end, the body goes out chunked
+                headers["content-encoding"] = coding
+                headers.add_vary_header("Accept-Encoding")
+                etag = headers.get("etag")
+                if etag and not etag.startswith("W/"):
+                    # same representation, different bytes: a strong ETag would be a lie
+                    headers["etag"] = f"W/{etag}"
+                await send(start_message)
+
+            started = time.thread_time()
+            chunk = compressor.compress(body)
+            if not more_body:
+                chunk += compressor.flush()
+            elif flush_chunks:
+                chunk += flush_block(compressor)
+            stats.cpu_seconds += time.thread_time() - started
+            stats.bytes_in += len(body)
+            stats.bytes_out += len(chunk)
+
+            if chunk or not more_body:
+                await send({"type": "http.response.body", "body": chunk, "more_body": more_body})
+
+        await self.app(scope, receive, send_compressed)
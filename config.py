@@ -14,5 +14,74 @@ class Settings(BaseSettings):
     algorithm: str = "HS256"  # algorithm used for JWT encoding/decoding; HS256 is a common choice for symmetric keys
     access_token_expire_minutes: int = 30
 
+    # DATABASE
+    database_url: str = "sqlite+aiosqlite:///./blog.db"
+    auto_migrate: bool = True  # apply pending migrations at startup, turn off when deploys run python -m migrations upgrade
+    migration_lock_timeout_seconds: float = 600  # workers starting together wait this long for the one migrating
+    db_write_pool_size: int = 1  # SQLite has a single writer anyway, more connections just fight over the lock
+    db_read_pool_size: int = 8
+    db_read_max_overflow: int = 8
+
+    # SQLite pragmas, applied to every new connection
+    sqlite_journal_mode: str = "WAL"  # readers don't block the writer and vice versa
+    sqlite_synchronous: str = "NORMAL"  # fsync at checkpoints instead of every commit, safe with WAL
+    sqlite_cache_size: int = -64_000  # negative means KiB, so ~64MB of page cache per connection
+    sqlite_mmap_size: int = 256 * 1024 * 1024  # read pages through memory mapping instead of read() calls
+    sqlite_busy_timeout_ms: int = 5000  # wait this long for a lock before raising "database is locked"
+
+    posts_per_page: int = 10  # default page size for the post feeds (api and html)
+    max_posts_per_page: int = 100  # upper bound for the ?limit= query parameter
+    post_excerpt_length: int = 300  # characters of content shown per post in the feeds
+    feed_size: int = 20  # entries in the atom feeds
+
+    views_flush_interval_seconds: float = 10  # buffered post views are written out this often (and at shutdown)
+
+    export_batch_size: int = 1000  # rows fetched per round trip when streaming exports
+    bulk_max_posts: int = 10_000  # max posts accepted by one POST /api/posts/bulk request
+    # posts deleted per transaction when an account is deleted. the lockout during a background
+    # deletion (deletion.in_progress) is per process: other workers keep accepting the account's
+    # tokens until the user row is gone, and the ON DELETE CASCADE removes what they wrote meanwhile
+    delete_batch_size: int = 500
+
+    search_title_weight: float = 10.0  # bm25 weight of a title match relative to a content match
+    search_snippet_tokens: int = 16  # max words in a search result snippet
+
+    post_cache_size: int = 1024  # max number of single posts kept in memory, 0 disables the cache
+    post_cache_ttl_seconds: float = 300  # safety net, writes invalidate entries right away anyway
+
+    page_cache_size: int = 256  # max number of rendered html pages kept in memory, 0 disables it
+    page_cache_ttl_seconds: float = 300
+    page_cache_max_page_bytes: int = 512 * 1024  # streamed pages bigger than this are sent but not cached
+    stream_chunk_size: int = 16 * 1024  # streamed pages go out in pieces of about this many characters
+
+    token_cache_size: int = 10_000  # verified jwt -> user id, entries expire with the token
+    user_cache_size: int = 10_000  # user id -> user snapshot for get_current_user
+    user_cache_ttl_seconds: float = 60  # bounds staleness across workers (see cache.user_cache), writes invalidate locally right away
+
+    password_hash_workers: int = 2  # argon2 hashes running at the same time, each one is a full core
+    password_hash_max_queue: int = 32  # requests allowed to wait for a worker before we answer 503
+
+    login_ip_burst: int = 20  # login attempts one IP can make back to back
+    login_ip_per_minute: float = 10  # and how fast it gets them back
+    login_email_burst: int = 5  # same per account, whatever IPs the attempts come from
+    login_email_per_minute: float = 1
+    ratelimit_max_keys: int = 100_000  # IPs/emails tracked per limiter, least recently seen go first
+
+    profile_pic_size: int = 256  # uploaded pictures are cropped to a square of this many pixels
+    profile_pic_max_bytes: int = 5 * 1024 * 1024  # larger uploads are rejected with 413
+    profile_pic_max_pixels: int = 40_000_000  # refuse images that would decode to more than this
+    upload_chunk_size: int = 64 * 1024  # bytes copied per read while streaming an upload to disk
+    image_workers: int = 2  # processes resizing uploads
+
+    compression_minimum_size: int = 1024  # bytes, smaller responses go out uncompressed
+    compression_gzip_level: int = 6  # 1-9, past 6 it's a lot more CPU for a few % smaller
+    compression_brotli_quality: int = 4  # 0-11, 11 is for build time only (see assets.py)
+    compression_zstd_level: int = 3  # 1-22
+
+    profile_token: SecretStr | None = None  # send it as X-Profile to profile a request, unset disables profiling
+    profile_dir: str = "profiles"  # where request profiles (.pstats) are written
+    slow_query_ms: float = 200  # statements slower than this are logged with their route
+    slow_query_log_size: int = 100  # slow queries kept in memory for /debug/slow-queries
+
 
 settings = Settings()  # Loaded from .env file, accessible as settings.secret_key, settings.algorithm, etc.
\ No newline at end of file
@@ -1,26 +1,110 @@
+from fastapi import Request
+from sqlalchemy import event
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, async_sessionmaker
 from sqlalchemy.orm import DeclarativeBase
- 
-SQLALCHEMY_DATABASE_URL = "sqlite+aiosqlite:///./blog.db"
 
+from config import settings
+from metrics import CallbackGauge, instrument_engine, register, route_label, timed_pool_class
+from slow_queries import instrument_slow_queries
+
+SQLALCHEMY_DATABASE_URL = settings.database_url  # defaults to sqlite+aiosqlite:///./blog.db
+
+IS_SQLITE = SQLALCHEMY_DATABASE_URL.startswith("sqlite")
+
+connect_args = {"check_same_thread": False} if IS_SQLITE else {}  # this is SQLite specific
+
+# WRITER ENGINE
+# SQLite only ever lets one connection write at a time, extra writer connections just
+# queue up on the file lock (and fail with "database is locked" once busy_timeout runs out)
+# so all writes go through a pool of db_write_pool_size (1 by default) connections
 engine = create_async_engine(
     SQLALCHEMY_DATABASE_URL,
-    connect_args={"check_same_thread": False},  # this is SQLite specific
+    connect_args=connect_args,
+    pool_size=settings.db_write_pool_size,
+    max_overflow=0,
+    poolclass=timed_pool_class("writer"),  # the default pool, plus checkout wait metrics
+)
+
+# READER ENGINE
+# in WAL mode readers never block the writer (or each other), so the GET routes get their own
+# bigger pool of read only connections and scale with concurrent requests
+read_engine = create_async_engine(
+    SQLALCHEMY_DATABASE_URL,
+    connect_args=connect_args,
+    pool_size=settings.db_read_pool_size,
+    max_overflow=settings.db_read_max_overflow,
+    poolclass=timed_pool_class("reader"),
 )
 
-AsyncSessionLocal = async_sessionmaker(   
+# per statement timing and per request query counts, see metrics.py
+instrument_engine(engine, "writer")
+instrument_engine(read_engine, "reader")
+instrument_slow_queries(engine)
+instrument_slow_queries(read_engine)
+register(CallbackGauge(
+    "db_pool_checked_out",
+    "Connections currently checked out of the pool",
+    ("engine",),
+    lambda: {("writer",): engine.pool.checkedout(), ("reader",): read_engine.pool.checkedout()},
+))
+
+
+def _set_sqlite_pragmas(dbapi_connection, query_only: bool) -> None:
+    # pragmas are per connection (journal_mode=WAL is stored in the file, the rest isn't)
+    # so they run every time the pool opens a new connection
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA journal_mode={settings.sqlite_journal_mode}")
+    cursor.execute(f"PRAGMA synchronous={settings.sqlite_synchronous}")  # NORMAL is safe with WAL
+    cursor.execute(f"PRAGMA cache_size={settings.sqlite_cache_size}")  # negative = KiB, positive = pages
+    cursor.execute(f"PRAGMA mmap_size={settings.sqlite_mmap_size}")
+    cursor.execute(f"PRAGMA busy_timeout={settings.sqlite_busy_timeout_ms}")  # wait for the lock instead of failing
+    cursor.execute("PRAGMA foreign_keys=ON")  # off by default in SQLite, ON DELETE CASCADE needs it
+    if query_only:
+        cursor.execute("PRAGMA query_only=ON")  # a write on a read session is a bug, fail loudly
+    cursor.close()
+
+
+if IS_SQLITE:
+
+    @event.listens_for(engine.sync_engine, "connect")
+    def _on_write_connect(dbapi_connection, _connection_record):
+        _set_sqlite_pragmas(dbapi_connection, query_only=False)
+
+    @event.listens_for(read_engine.sync_engine, "connect")
+    def _on_read_connect(dbapi_connection, _connection_record):
+        _set_sqlite_pragmas(dbapi_connection, query_only=True)
+
+
+AsyncSessionLocal = async_sessionmaker(
     engine,
     class_=AsyncSession,
     expire_on_commit=False,
 )  # creates database sessions
 
+ReadSessionLocal = async_sessionmaker(
+    read_engine,
+    class_=AsyncSession,
+    expire_on_commit=False,
+)  # read only sessions for the GET routes
+
 
 class Base(DeclarativeBase):
     pass
 
 
-async def get_db(): #CONVERTED TO ASYNC FUNCTION
+def _request_route(request: Request) -> str:
+    # "GET /api/posts/{post_id}", what the slow query log shows as the origin of a query
+    return f"{request.method} {route_label(request.scope)}"
+
+
+async def get_db(request: Request): #CONVERTED TO ASYNC FUNCTION
     # dependency function; provides a database session to path operations
     # ensures proper opening and closing of sessions
-    async with AsyncSessionLocal() as session:  # ensures cleanup even if an error occurs
+    async with AsyncSessionLocal(info={"route": _request_route(request)}) as session:  # ensures cleanup even if an error occurs
+        yield session
+
+
+async def get_read_db(request: Request):
+    # same as get_db but on the read only engine, use it for routes that never write
+    async with ReadSessionLocal(info={"route": _request_route(request)}) as session:
         yield session
@@ -0,0 +1,73 @@
+# ACCOUNT DELETION
+# db.delete(user) made the ORM load every post of the user (for the delete-orphan cascade)
+# and send one DELETE per row, all in one transaction holding the SQLite write lock. here
+# posts go in set-based batches instead:
+#   DELETE FROM posts WHERE id IN (SELECT id FROM posts WHERE user_id = ? LIMIT n)
+# each batch is its own short transaction, so other writers get the lock in between, and
+# the user row goes last. posts.user_id is ON DELETE CASCADE (migration 7), so whatever
+# was posted while the batches ran still disappears with the user.
+#
+# very large accounts can be deleted in the background (?background=true, 202). while that
+# runs the account is locked out, but only in this process: its tokens stop working here
+# (auth.py), the other workers accept them until the user row is deleted, and whatever they
+# write in the meantime goes with it through the cascade
+
+import asyncio
+import logging
+
+from sqlalchemy import delete, select
+
+import models
+from cache import bump_content_version, invalidate_author
+from config import settings
+from database import engine
+
+logger = logging.getLogger("blog.deletion")
+
+posts = models.Post.__table__
+
+in_progress: set[int] = set()  # user ids being deleted by this process
+
+
+async def _delete_posts_batch(user_id: int) -> int:
+    async with engine.begin() as conn:
+        result = await conn.execute(
+            delete(posts).where(
+                posts.c.id.in_(
+                    select(posts.c.id).where(posts.c.user_id == user_id).limit(settings.delete_batch_size),
+                ),
+            ),
+        )
+    return result.rowcount
+
+
+async def delete_account(user_id: int) -> int:
+    """Delete a user and all their posts in batches, returns the number of posts deleted."""
+    in_progress.add(user_id)
+    invalidate_author(user_id)  # drops the cached user, the next request sees in_progress
+    deleted = 0
+    try:
+        while True:
+            count = await _delete_posts_batch(user_id)
+            deleted += count
+            if count < settings.delete_batch_size:
+                break
+            await asyncio.sleep(0)  # let the requests waiting for the writer go first
+        async with engine.begin() as conn:
+            await conn.execute(delete(models.User.__table__).where(models.User.id == user_id))
+    finally:
+        in_progress.discard(user_id)
+        # posts may already be gone even if something failed halfway
+        invalidate_author(user_id)
+        bump_content_version()
+    return deleted
+
+
+async def delete_account_in_background(user_id: int) -> None:
+    # nobody is waiting for the result, so failures only end up in the log
+    try:
+        deleted = await delete_account(user_id)
+    except Exception:
+        logger.exception("deleting user %d failed", user_id)
+    else:
+        logger.info("deleted user %d and %d posts", user_id, deleted)
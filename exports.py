@@ -0,0 +1,105 @@
+# STREAMING EXPORT OF POSTS (NDJSON / CSV)
+# the list endpoints build every PostResponse in memory before sending anything,
+# here we pull rows from a server side cursor in fixed size batches and write
+# them out as we go, so memory stays flat no matter how many posts there are
+
+import csv
+import io
+import json
+from collections.abc import AsyncIterator
+from typing import Literal
+
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
+
+import models
+from config import settings
+from database import ReadSessionLocal
+
+ExportFormat = Literal["ndjson", "csv"]
+
+EXPORT_COLUMNS = ["id", "title", "content", "user_id", "author_username", "date_posted"]
+
+MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv; charset=utf-8",
+}
+
+
+def _export_query(user_id: int | None):
+    # plain columns instead of ORM objects, no identity map and no author relationship loading
+    query = (
+        select(
+            models.Post.id,
+            models.Post.title,
+            models.Post.content,
+            models.Post.user_id,
+            models.User.username.label("author_username"),
+            models.Post.date_posted,
+        )
+        .join(models.User, models.Post.user_id == models.User.id)
+        .order_by(models.Post.date_posted.desc(), models.Post.id.desc())
+        .execution_options(yield_per=settings.export_batch_size)
+    )
+    if user_id is not None:
+        query = query.where(models.Post.user_id == user_id)
+    return query
+
+
+def _ndjson_batch(rows) -> str:
+    return "".join(
+        json.dumps(
+            {
+                "id": row.id,
+                "title": row.title,
+                "content": row.content,
+                "user_id": row.user_id,
+                "author_username": row.author_username,
+                "date_posted": row.date_posted.isoformat(),
+            },
+            ensure_ascii=False,
+        )
+        + "\n"
+        for row in rows
+    )
+
+
+def _csv_batch(rows, header: bool) -> str:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(EXPORT_COLUMNS)
+    writer.writerows(
+        (row.id, row.title, row.content, row.user_id, row.author_username, row.date_posted.isoformat())
+        for row in rows
+    )
+    return buffer.getvalue()
+
+
+async def _iter_export(fmt: ExportFormat, user_id: int | None) -> AsyncIterator[str]:
+    # the generator opens its own (read only) session, the request scoped one
+    # should not be held open for however long the client takes to download
+    async with ReadSessionLocal() as session:
+        result = await session.stream(_export_query(user_id))
+
+        if fmt == "csv":
+            header_sent = False
+            async for rows in result.partitions():
+                yield _csv_batch(rows, header=not header_sent)
+                header_sent = True
+            if not header_sent:
+                yield _csv_batch([], header=True)  # empty export still gets the header row
+        else:
+            async for rows in result.partitions():  # partitions are yield_per sized
+                yield _ndjson_batch(rows)
+
+
+def export_posts_response(fmt: ExportFormat, user_id: int | None = None) -> StreamingResponse:
+    """Stream all posts (optionally of one author) as NDJSON or CSV."""
+    filename = "posts" if user_id is None else f"user_{user_id}_posts"
+    extension = "ndjson" if fmt == "ndjson" else "csv"
+    return StreamingResponse(
+        _iter_export(fmt, user_id),
+        media_type=MEDIA_TYPES[fmt],
+        headers={"Content-Disposition": f'attachment; filename="{filename}.{extension}"'},
+    )
@@ -0,0 +1,159 @@
+# LIGHTWEIGHT POST FEEDS
+# the list routes don't need full Post objects: no content column, no separate author query.
+# one SELECT pulls just the columns a feed shows, computes the excerpt in SQL (so the full
+# content never leaves SQLite) and joins the author in the same round trip
+
+from datetime import datetime
+from typing import TypedDict
+
+from fastapi import HTTPException, Response, status
+from pydantic import TypeAdapter
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import models
+from config import settings
+from pagination import paginate_posts, split_page
+from schemas import PostSummary
+
+SUMMARY_FIELDS = frozenset(PostSummary.model_fields)
+
+# the users columns every embedded author needs, shared with the search query
+AUTHOR_COLUMNS = (
+    models.User.username,
+    models.User.image_file,
+    models.User.post_count,
+    models.User.last_posted_at,
+    models.User.total_chars,
+)
+
+
+def summary_query(user_id: int | None = None):
+    query = select(
+        models.Post.id,
+        models.Post.title,
+        func.substr(models.Post.content, 1, settings.post_excerpt_length).label("excerpt"),
+        (func.length(models.Post.content) > settings.post_excerpt_length).label("truncated"),
+        models.Post.user_id,
+        models.Post.date_posted,
+        models.Post.view_count,
+        *AUTHOR_COLUMNS,
+    ).join(models.User, models.User.id == models.Post.user_id)
+    if user_id is not None:
+        query = query.where(models.Post.user_id == user_id)
+    return query
+
+
+# FAST SERIALIZATION PATH
+# building a PostSummary model per row, having FastAPI validate it against response_model
+# and then json.dumps the result costs more than the query itself. the feed routes opt out
+# of all that: rows become plain dicts and one prebuilt TypeAdapter turns the whole page into
+# JSON bytes in pydantic-core (Rust), without validating anything on the way out.
+# the TypedDicts below mirror PostSummary / PostSummaryPage, which stay the documented schema
+
+
+class _AuthorDict(TypedDict):
+    id: int
+    username: str
+    image_file: str | None
+    image_path: str
+    post_count: int
+    last_posted_at: datetime | None
+    total_chars: int
+
+
+class _PostSummaryDict(TypedDict, total=False):  # total=False so sparse fieldsets can drop keys
+    id: int
+    title: str
+    excerpt: str
+    truncated: bool
+    user_id: int
+    date_posted: datetime
+    view_count: int
+    author: _AuthorDict
+
+
+class PostSummaryPageDict(TypedDict):
+    posts: list[_PostSummaryDict]
+    next_cursor: str | None
+
+
+_page_adapter = TypeAdapter(PostSummaryPageDict)
+_list_adapter = TypeAdapter(list[_PostSummaryDict])
+
+
+def author_from_row(row) -> _AuthorDict:
+    """Build the embedded author from a row selected with AUTHOR_COLUMNS."""
+    return {
+        "id": row.user_id,
+        "username": row.username,
+        "image_file": row.image_file,
+        "image_path": models.profile_image_path(row.image_file),
+        "post_count": row.post_count,
+        "last_posted_at": row.last_posted_at,
+        "total_chars": row.total_chars,
+    }
+
+
+def summary_from_row(row) -> _PostSummaryDict:
+    """Build a post summary from a row selected with summary_query."""
+    return {
+        "id": row.id,
+        "title": row.title,
+        "excerpt": row.excerpt,
+        "truncated": bool(row.truncated),
+        "user_id": row.user_id,
+        "date_posted": row.date_posted,
+        "view_count": row.view_count,
+        "author": author_from_row(row),
+    }
+
+
+async def fetch_summary_page(
+    db: AsyncSession,
+    cursor: str | None,
+    limit: int,
+    user_id: int | None = None,
+) -> PostSummaryPageDict:
+    """Fetch one keyset page of post summaries, optionally for a single author."""
+    result = await db.execute(paginate_posts(summary_query(user_id), cursor, limit))
+    rows, next_cursor = split_page(result.all(), limit)
+    return {"posts": [summary_from_row(row) for row in rows], "next_cursor": next_cursor}
+
+
+async def fetch_most_viewed(db: AsyncSession, limit: int) -> list[_PostSummaryDict]:
+    """The limit posts with the most (flushed) views, walked backwards off ix_posts_view_count_id."""
+    result = await db.execute(
+        summary_query()
+        .order_by(models.Post.view_count.desc(), models.Post.id.desc())
+        .limit(limit),
+    )
+    return [summary_from_row(row) for row in result]
+
+
+def parse_fields(fields: str | None) -> set[str] | None:
+    """Parse a ?fields=id,title sparse fieldset, None means every field."""
+    if not fields:
+        return None
+    requested = {field.strip() for field in fields.split(",") if field.strip()}
+    unknown = requested - SUMMARY_FIELDS
+    if unknown:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unknown fields: {', '.join(sorted(unknown))}",
+        )
+    return requested
+
+
+def summary_page_response(page: PostSummaryPageDict, fields: set[str] | None) -> Response:
+    """Serialize a page straight to JSON bytes, trimmed to the requested fields if any."""
+    if fields is not None:
+        page = {
+            "posts": [{key: post[key] for key in fields} for post in page["posts"]],
+            "next_cursor": page["next_cursor"],
+        }
+    return Response(_page_adapter.dump_json(page), media_type="application/json")
+
+
+def summary_list_response(posts: list[_PostSummaryDict]) -> Response:
+    return Response(_list_adapter.dump_json(posts), media_type="application/json")
@@ -0,0 +1,149 @@
+# PROFILE PICTURE UPLOADS
+# the upload is streamed to a temp file in chunks (never held in memory as a whole) and
+# hashed on the way, the sha256 of the bytes becomes the file name. two users uploading
+# the same picture share one file, and re-uploading a picture skips the resize entirely.
+# decoding and resizing is pure CPU work and Pillow holds the GIL for most of it, so it
+# runs in a small process pool instead of a thread next to the event loop.
+#
+# a hash named file never changes, which is what lets /media send it with an immutable
+# Cache-Control header: browsers and CDNs keep it for a year without ever revalidating
+
+import asyncio
+import hashlib
+import multiprocessing
+import os
+import re
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+
+from fastapi import HTTPException, UploadFile, status
+from fastapi.staticfiles import StaticFiles
+from starlette.concurrency import run_in_threadpool
+
+from config import settings
+
+PROFILE_PICS_DIR = Path("media/profile_pics")
+
+# <32 hex chars>.jpg, anything else under /media (older hand-set names) keeps the default headers
+_HASHED_NAME = re.compile(r"^[0-9a-f]{32}\.jpg$")
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+def make_thumbnail(source: str, destination: str, size: int, max_pixels: int) -> None:
+    """Decode an image, crop it to a centered square and save it as a JPEG (runs in a worker process)."""
+    from PIL import Image, ImageOps  # imported in the worker, the web process never needs Pillow loaded
+
+    Image.MAX_IMAGE_PIXELS = max_pixels  # refuse decompression bombs
+    try:
+        with Image.open(source) as image:
+            image = ImageOps.exif_transpose(image)  # phone pictures are often stored sideways
+            image = ImageOps.fit(image.convert("RGB"), (size, size), Image.Resampling.LANCZOS)
+    except (OSError, Image.DecompressionBombError) as exc:
+        # not an image, truncated, or way too many pixels: the client's fault, not ours
+        raise ValueError(str(exc)) from None
+    image.save(destination, "JPEG", quality=85, optimize=True)
+
+
+@dataclass
+class ImageStats:
+    uploads: int = 0
+    deduplicated: int = 0  # uploads whose thumbnail already existed, no resize needed
+    rejected: int = 0  # too large or not an image
+    resize_seconds_total: float = 0.0
+
+
+stats = ImageStats()
+_executor: ProcessPoolExecutor | None = None  # created on first upload
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(
+            max_workers=settings.image_workers,
+            # spawn instead of fork: forking a process that runs threads (the db and hash
+            # pools) can copy a lock in its held state and deadlock the child
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _executor
+
+
+def shutdown_image_pool() -> None:
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=True)
+        _executor = None
+
+
+def _reject(status_code: int, detail: str) -> HTTPException:
+    stats.rejected += 1
+    return HTTPException(status_code=status_code, detail=detail)
+
+
+async def _stream_to_disk(upload: UploadFile, path: Path) -> str:
+    """Copy the upload to path chunk by chunk, return the hex digest of what was written."""
+    # the thumbnail settings are part of the hash, so changing them never serves an old thumbnail
+    digest = hashlib.sha256(f"{settings.profile_pic_size}:".encode())
+    written = 0
+    with open(path, "wb") as out:
+        while chunk := await upload.read(settings.upload_chunk_size):
+            written += len(chunk)
+            if written > settings.profile_pic_max_bytes:
+                raise _reject(status.HTTP_413_CONTENT_TOO_LARGE, "Image is too large")
+            digest.update(chunk)
+            await run_in_threadpool(out.write, chunk)
+    return digest.hexdigest()[:32]
+
+
+async def save_profile_picture(upload: UploadFile) -> str:
+    """Store an uploaded picture as a square JPEG thumbnail, return its content addressed file name."""
+    if upload.size is not None and upload.size > settings.profile_pic_max_bytes:
+        raise _reject(status.HTTP_413_CONTENT_TOO_LARGE, "Image is too large")
+
+    PROFILE_PICS_DIR.mkdir(parents=True, exist_ok=True)
+    tmp_id = uuid.uuid4().hex
+    raw_path = PROFILE_PICS_DIR / f".upload-{tmp_id}"
+    thumb_path = PROFILE_PICS_DIR / f".thumb-{tmp_id}.jpg"
+    try:
+        name = f"{await _stream_to_disk(upload, raw_path)}.jpg"
+        final_path = PROFILE_PICS_DIR / name
+        stats.uploads += 1
+        if final_path.exists():
+            stats.deduplicated += 1
+            return name
+
+        started_at = time.perf_counter()
+        try:
+            await asyncio.get_running_loop().run_in_executor(
+                _get_executor(),
+                make_thumbnail,
+                str(raw_path),
+                str(thumb_path),
+                settings.profile_pic_size,
+                settings.profile_pic_max_pixels,
+            )
+        except ValueError:
+            raise _reject(status.HTTP_400_BAD_REQUEST, "Invalid image file")
+        finally:
+            stats.resize_seconds_total += time.perf_counter() - started_at
+
+        # written under a temp name and renamed, so /media never serves a half written file
+        # (two concurrent uploads of the same picture just replace it with identical bytes)
+        os.replace(thumb_path, final_path)
+        return name
+    finally:
+        raw_path.unlink(missing_ok=True)
+        thumb_path.unlink(missing_ok=True)
+
+
+class MediaFiles(StaticFiles):
+    """StaticFiles that marks content addressed uploads as immutable."""
+
+    def file_response(self, full_path, stat_result, scope, status_code=200):
+        response = super().file_response(full_path, stat_result, scope, status_code)
+        if _HASHED_NAME.match(os.path.basename(full_path)):
+            response.headers["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+        return response
@@ -1,7 +1,13 @@
 # for authentication use pwdlib[argon2], pyjwt, pydantic-settings (for managing settings) packages
 
+import hashlib
+import secrets
+import time
 from contextlib import asynccontextmanager
-from typing import Annotated
+from dataclasses import asdict
+from datetime import UTC, datetime
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Annotated, NamedTuple
 
 from fastapi import Depends, FastAPI, HTTPException, Request, status
 # HTTPException used to respond with proper HTTP error responses
@@ -10,17 +16,38 @@ from fastapi import Depends, FastAPI, HTTPException, Request, status
 
 from fastapi.exceptions import RequestValidationError
 # from fastapi.responses import JSONResponse #NOT NEEDED ANYMORE
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates  # the {{}} thing used in templates is jinja2
+from jinja2 import Environment, FileSystemLoader
 
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession  # needed for async
-from sqlalchemy.orm import selectinload  # needed for async
 
 from starlette.exceptions import HTTPException as StarletteHTTPException  # the thing which actually deals with the http exception
 
+import assets
+import cache
+import compress
+import images
+import metrics
+import migrations
 import models
-from database import Base, engine, get_db
+import profiling
+import ratelimit
+import slow_queries
+import streaming
+import views
+from auth import PasswordHashStats, password_hash_pool
+from cache import CacheStats
+from compress import CompressionMiddleware, CompressionStats
+from config import settings
+from database import engine, get_read_db, read_engine
+from feeds import fetch_summary_page, summary_query
+from images import ImageStats, MediaFiles, shutdown_image_pool
+from pagination import paginate_posts
+from schemas import PostResponse, PostSearchPage
+from search import search_posts
 
 # ROUTERS need the basic router directory with the __init__.py mandatory
 from routers import posts, users
@@ -40,21 +67,56 @@ from fastapi.exception_handlers import (
 @asynccontextmanager
 async def lifespan(_app: FastAPI):
     # startup
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)  # enables lazy loading of tables, creates tables if they don't exist when the app starts up
+    assets.build_assets()  # only copies/compresses files that changed since the last build
+    # one SELECT on schema_version when the database is current, see migrations/__init__.py
+    await migrations.check_schema(engine)
+    view_flusher = views.start_flusher()
     yield
     # shutdown
+    await views.stop_flusher(view_flusher)  # last batch of views, before the engine goes away
+    password_hash_pool.shutdown()
+    shutdown_image_pool()
     await engine.dispose()
+    await read_engine.dispose()
 
 
 app = FastAPI(lifespan=lifespan)
+app.add_middleware(CompressionMiddleware, minimum_size=settings.compression_minimum_size)
+app.add_middleware(profiling.ProfilingMiddleware)  # only does anything with a valid X-Profile header
+app.add_middleware(metrics.MetricsMiddleware)  # added last = outermost, so its timings include compression
 
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
+# fingerprinted copies of the css/js/icons, built at startup, cached by browsers forever
+# check_dir=False because the directory only exists once the lifespan has built it
+app.mount(
+    assets.ASSET_URL_PREFIX,
+    assets.AssetFiles(directory=assets.BUILD_DIR, check_dir=False),
+    name="assets",
+)
+
 # mount media directory for user uploaded content
-app.mount("/media", StaticFiles(directory="media"), name="media")
+# uploads are stored under their content hash, MediaFiles serves those as immutable
+app.mount("/media", MediaFiles(directory="media"), name="media")
 
 templates = Jinja2Templates(directory="templates")
+# same templates on an async environment, for the pages streamed as they render (streaming.py)
+stream_templates = Jinja2Templates(
+    env=Environment(loader=FileSystemLoader("templates"), autoescape=True, enable_async=True),
+)
+
+
+def _as_utc(value: datetime) -> datetime:
+    # SQLite hands DateTime(timezone=True) columns back naive, they were stored in UTC
+    return value.replace(tzinfo=UTC) if value.tzinfo is None else value.astimezone(UTC)
+
+
+for _env in (templates.env, stream_templates.env):
+    _env.globals["asset_url"] = assets.asset_url
+    _env.globals["asset_import_map"] = assets.asset_import_map
+    _env.filters["rfc3339"] = lambda value: _as_utc(value).isoformat(timespec="seconds")
+templates.env.globals["stream_flush"] = lambda: ""
+stream_templates.env.globals["stream_flush"] = lambda: streaming.FLUSH
 
 ### CRUD
 # C - CREATE - Post
@@ -66,6 +128,142 @@ app.include_router(users.router, prefix="/api/users", tags=["users"])
 app.include_router(posts.router, prefix="/api/posts", tags=["posts"])
 
 
+# RENDERED PAGE CACHE
+# the html pages only change when a post or user is written, so we keep the rendered
+# bytes around keyed by url and content version. every write path calls
+# cache.bump_content_version() which throws all of them away.
+# the pages are the same for everyone (login state is handled by js on the client)
+# so anonymous and logged in traffic can share the cache.
+# the ETag comes from the same content version and url, not from the body: streamed pages
+# send their headers before the body exists and pages over page_cache_max_page_bytes are
+# never kept, and both still have to answer If-None-Match with a 304
+
+
+class CachedPage(NamedTuple):
+    body: bytes
+    etag: str | None  # None if a write happened while it rendered, see _page_etag
+    media_type: str = "text/html"
+    last_modified: str | None = None  # http date, only the atom feeds send one
+
+
+def _page_key(request: Request) -> tuple[int, str]:
+    return cache.content_version, str(request.url)
+
+
+_boot_id = secrets.token_hex(8)  # content_version starts over at 0 in every process
+
+
+def _page_etag(request: Request, stamp: int) -> str | None:
+    # the page only changes with content_version, as far as this process knows. writes made
+    # through other workers don't bump it, so the tag also rolls over every page cache ttl,
+    # the same bound the cached bytes have. None if a write happened since the stamp: the
+    # body may already show it while content_version says otherwise
+    if stamp != cache.page_cache.stamp():
+        return None
+    window = int(time.time() // max(settings.page_cache_ttl_seconds, 1))
+    seed = f"{_boot_id}:{cache.content_version}:{window}:{request.url}"
+    return f'"{hashlib.sha256(seed.encode()).hexdigest()[:32]}"'
+
+
+def _etag_matches(request: Request, etag: str | None) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if not etag or not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # If-None-Match uses weak comparison, so W/"x" matches "x"
+    candidates = (tag.strip().removeprefix("W/") for tag in if_none_match.split(","))
+    return etag in candidates
+
+
+def _not_modified_since(request: Request, last_modified: str | None) -> bool:
+    # only looked at without If-None-Match, the etag is the more precise of the two
+    if_modified_since = request.headers.get("if-modified-since")
+    if not last_modified or not if_modified_since or "if-none-match" in request.headers:
+        return False
+    try:
+        return parsedate_to_datetime(last_modified) <= parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):  # not a valid http date, send the page
+        return False
+
+
+def page_response(request: Request, page: CachedPage) -> Response:
+    """Send a cached page, or a bodyless 304 if the client already has this version."""
+    headers = _page_headers(page.etag)
+    if page.last_modified:
+        headers["Last-Modified"] = page.last_modified
+    if _etag_matches(request, page.etag) or _not_modified_since(request, page.last_modified):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(page.body, media_type=page.media_type, headers=headers)
+
+
+def _page_headers(etag: str | None) -> dict[str, str]:
+    headers = {"Cache-Control": "no-cache"}  # browsers may keep it but must revalidate with If-None-Match
+    if etag:
+        headers["ETag"] = etag
+    return headers
+
+
+def cached_page(request: Request) -> Response | None:
+    """Serve the page from the cache if we have it, before any database work."""
+    page = cache.page_cache.get(_page_key(request))
+    if page is None:
+        # not kept (too big, evicted, expired), but the client may have this version already
+        etag = _page_etag(request, cache.page_cache.stamp())
+        if _etag_matches(request, etag):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=_page_headers(etag))
+        return None
+    return page_response(request, page)
+
+
+def render_page(
+    request: Request,
+    name: str,
+    context: dict,
+    stamp: int,
+    media_type: str = "text/html",
+    last_modified: datetime | None = None,
+) -> Response:
+    """Render a template, store it in the page cache and send it."""
+    body = templates.get_template(name).render({**context, "request": request}).encode()
+    page = CachedPage(
+        body,
+        _page_etag(request, stamp),
+        media_type,
+        format_datetime(_as_utc(last_modified), usegmt=True) if last_modified else None,
+    )
+    cache.page_cache.set(_page_key(request), page, stamp=stamp)  # skipped if a write happened since the stamp
+    return page_response(request, page)
+
+
+def stream_page(request: Request, name: str, context: dict, stamp: int) -> StreamingResponse:
+    """Send a template while it renders, keeping a copy for the page cache if it's small enough."""
+    key = _page_key(request)  # now, not once the body is done
+    etag = _page_etag(request, stamp)
+
+    async def body():
+        kept: list[bytes] | None = []
+        size = 0
+        template = stream_templates.get_template(name)
+        async for chunk in streaming.iter_template(template, {**context, "request": request}):
+            if kept is not None:
+                size += len(chunk)
+                if size <= settings.page_cache_max_page_bytes:
+                    kept.append(chunk)
+                else:
+                    kept = None  # a huge page isn't worth holding on to, just stream the rest
+            yield chunk
+        if kept is not None:
+            cache.page_cache.set(key, CachedPage(b"".join(kept), etag), stamp=stamp)
+
+    return StreamingResponse(
+        body(),
+        media_type="text/html",
+        # X-Accel-Buffering: no asks nginx and our CompressionMiddleware to pass chunks on right away
+        headers={**_page_headers(etag), "X-Accel-Buffering": "no"},
+    )
+
+
 # SYNCHRONOUS PATH OPERATIONS
 # running function with def keyword runs in the main thread, blocks other operations until it finishes
 # running route with async def allows other operations to run while waiting for the function to complete,
@@ -74,43 +272,47 @@ app.include_router(posts.router, prefix="/api/posts", tags=["posts"])
 
 @app.get("/", include_in_schema=False, name="home")
 @app.get("/posts", include_in_schema=False, name="posts")
-async def home(request: Request, db: Annotated[AsyncSession, Depends(get_db)]):
-
-    result = await db.execute(
-        select(models.Post)
-        .options(selectinload(models.Post.author))  # eager loading
-        .order_by(models.Post.date_posted.desc())
-    )
+async def home(
+    request: Request,
+    cursor: str | None = None,
+):
 
-    # .order_by(models.Post.date_posted.desc()) --> ordering posts by descending order
+    if response := cached_page(request):
+        return response
+    stamp = cache.page_cache.stamp()
 
-    posts = result.scalars().all()
+    # same lightweight projection as the api feed: excerpts, author joined in one query.
+    # built (and the cursor checked) here, so a bad cursor is still a 400 and not a broken stream
+    query = paginate_posts(summary_query(), cursor, settings.posts_per_page)
 
-    return templates.TemplateResponse(
+    return stream_page(
         request,
         "home.html",
-        {"posts": posts, "title": "Home"},
+        {"posts": streaming.PostStream(query, settings.posts_per_page), "title": "Home"},
+        stamp,
     )
 
 
 @app.get("/posts/{post_id}", include_in_schema=False)
-async def post_page(request: Request, post_id: int, db: Annotated[AsyncSession, Depends(get_db)]):
+async def post_page(request: Request, post_id: int, db: Annotated[AsyncSession, Depends(get_read_db)]):
 
-    result = await db.execute(
-        select(models.Post)
-        .options(selectinload(models.Post.author))
-        .where(models.Post.id == post_id)
-    )
+    if response := cached_page(request):
+        views.view_counter.record(post_id)  # only 200 pages are cached or get an etag, so the post exists
+        return response
+    stamp = cache.page_cache.stamp()
 
-    post = result.scalars().first()
+    payload = await posts.get_post_json(db, post_id)  # shares the post cache with the api route
 
-    if post:
+    if payload:
+        post = PostResponse.model_validate_json(payload)
         title = post.title[:50]
+        views.view_counter.record(post_id)
 
-        return templates.TemplateResponse(
+        return render_page(
             request,
             "post.html",
             {"post": post, "title": title},
+            stamp,
         )
 
     raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Post not found")
@@ -120,9 +322,14 @@ async def post_page(request: Request, post_id: int, db: Annotated[AsyncSession,
 async def user_posts_page(
     request: Request,
     user_id: int,
-    db: Annotated[AsyncSession, Depends(get_db)],
+    db: Annotated[AsyncSession, Depends(get_read_db)],
+    cursor: str | None = None,
 ):
 
+    if response := cached_page(request):
+        return response
+    stamp = cache.page_cache.stamp()
+
     # FIX: ordering posts must not happen on the User query
     result = await db.execute(
         select(models.User).where(models.User.id == user_id)
@@ -136,19 +343,110 @@ async def user_posts_page(
             detail="User not found",
         )
 
-    result = await db.execute(
-        select(models.Post)
-        .options(selectinload(models.Post.author))
-        .where(models.Post.user_id == user_id)
-        .order_by(models.Post.date_posted.desc())
+    query = paginate_posts(summary_query(user_id), cursor, settings.posts_per_page)
+
+    return stream_page(
+        request,
+        "user_posts.html",
+        {
+            "posts": streaming.PostStream(query, settings.posts_per_page),
+            "user": user,
+            "title": f"{user.username}'s Posts",
+        },
+        stamp,
     )
 
-    posts = result.scalars().all()
 
-    return templates.TemplateResponse(
+@app.get("/search", include_in_schema=False, name="search_page")
+async def search_page(
+    request: Request,
+    db: Annotated[AsyncSession, Depends(get_read_db)],
+    q: str = "",
+    cursor: str | None = None,
+):
+
+    if response := cached_page(request):
+        return response
+    stamp = cache.page_cache.stamp()
+
+    q = q.strip()[:200]  # same limit as the api route
+    if q:
+        page = await search_posts(db, q, cursor, settings.posts_per_page)
+    else:
+        page = PostSearchPage(results=[], next_cursor=None)
+
+    return render_page(
         request,
-        "user_posts.html",
-        {"posts": posts, "user": user, "title": f"{user.username}'s Posts"},
+        "search.html",
+        {
+            "q": q,
+            "results": page.results,
+            "next_cursor": page.next_cursor,
+            "title": f"Search: {q}" if q else "Search",
+        },
+        stamp,
+    )
+
+
+# ATOM FEEDS
+# feed readers poll these every few minutes. they go through the page cache like the html
+# pages, so the XML is rendered once per content version and a poll that already has it
+# gets a 304 (If-None-Match or If-Modified-Since) before any database work
+
+
+@app.get("/feed.atom", include_in_schema=False, name="feed")
+async def feed(request: Request, db: Annotated[AsyncSession, Depends(get_read_db)]):
+
+    if response := cached_page(request):
+        return response
+    stamp = cache.page_cache.stamp()
+    modified = cache.content_modified_at  # with the stamp, before the query
+
+    page = await fetch_summary_page(db, None, settings.feed_size)
+
+    return _render_feed(request, page["posts"], stamp, modified, alternate_url=request.url_for("home"))
+
+
+@app.get("/users/{user_id}/feed.atom", include_in_schema=False, name="user_feed")
+async def user_feed(request: Request, user_id: int, db: Annotated[AsyncSession, Depends(get_read_db)]):
+
+    if response := cached_page(request):
+        return response
+    stamp = cache.page_cache.stamp()
+    modified = cache.content_modified_at
+
+    result = await db.execute(select(models.User).where(models.User.id == user_id))
+    user = result.scalars().first()
+    if not user:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
+
+    page = await fetch_summary_page(db, None, settings.feed_size, user_id=user_id)
+
+    return _render_feed(
+        request, page["posts"], stamp, modified, alternate_url=request.url_for("user_posts", user_id=user_id), user=user,
+    )
+
+
+def _render_feed(request: Request, posts: list, stamp: int, modified: datetime, alternate_url, user=None) -> Response:
+    # newest first, so the first entry dates the whole feed. Last-Modified can't use it: an
+    # edit, a delete or a renamed author changes the feed without a newer date_posted, and
+    # If-Modified-Since would keep answering 304. the content version moves on every write,
+    # same as the etag, so its timestamp is the one sent (taken before the query: a write
+    # racing the render makes it older, which costs a refetch and never a stale 304)
+    updated = posts[0]["date_posted"] if posts else None
+    return render_page(
+        request,
+        "feed.atom",
+        {
+            "posts": posts,
+            "user": user,
+            "self_url": request.url,
+            "alternate_url": alternate_url,
+            "updated": updated or datetime.now(UTC),
+        },
+        stamp,
+        media_type="application/atom+xml",
+        last_modified=modified,
     )
 
 
@@ -182,6 +480,62 @@ async def account_page(request: Request):
         {"title": "Account"},
     )
 
+
+# METRICS
+# request, SQL and pool metrics register themselves (metrics.py, database.py), the stats
+# the other modules already keep are exported from here
+
+_caches = (cache.post_cache, cache.page_cache, cache.token_cache, cache.user_cache)
+metrics.register_stats("cache", "Cache activity", "cache", CacheStats, lambda: {c.name: c.stats for c in _caches})
+metrics.register(metrics.CallbackGauge(
+    "cache_entries", "Entries currently held", ("cache",), lambda: {(c.name,): len(c) for c in _caches},
+))
+metrics.register_stats(
+    "password_hash", "Password hashing pool", "pool", PasswordHashStats,
+    lambda: {"argon2": password_hash_pool.stats},
+)
+metrics.register(metrics.CallbackGauge(
+    "password_hash_in_flight", "Hashes running right now", (), lambda: {(): password_hash_pool.in_flight},
+))
+metrics.register(metrics.CallbackGauge(
+    "password_hash_queued", "Requests waiting for a hashing worker", (), lambda: {(): password_hash_pool.queued},
+))
+metrics.register_stats(
+    "ratelimit", "Login throttling", "limiter", ratelimit.RateLimitStats,
+    lambda: {limiter.name: limiter.stats for limiter in ratelimit.limiters},
+)
+metrics.register(metrics.CallbackGauge(
+    "ratelimit_keys", "Keys tracked per limiter", ("limiter",),
+    lambda: {(limiter.name,): len(limiter) for limiter in ratelimit.limiters},
+))
+metrics.register_stats("image", "Profile picture uploads", "kind", ImageStats, lambda: {"profile": images.stats})
+metrics.register_stats("views", "Buffered post view counters", "counter", views.ViewStats, lambda: {"post": views.view_counter.stats})
+metrics.register(metrics.CallbackGauge(
+    "views_pending_posts", "Posts with views waiting for the next flush", (), lambda: {(): len(views.view_counter)},
+))
+metrics.register_stats(
+    "compression", "Response compression", "route", CompressionStats, lambda: dict(compress.route_stats),
+)
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics_endpoint():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+# DEBUG ROUTES
+# only exist when settings.profile_token is set, and need it in the X-Profile header
+
+
+@app.get("/debug/profiles/{profile_id}", include_in_schema=False, dependencies=[Depends(profiling.require_profile_token)])
+async def get_profile(profile_id: str):
+    return PlainTextResponse(profiling.profile_report(profiling.profile_path(profile_id)))
+
+
+@app.get("/debug/slow-queries", include_in_schema=False, dependencies=[Depends(profiling.require_profile_token)])
+async def get_slow_queries():
+    return [asdict(entry) for entry in reversed(slow_queries.recent)]  # newest first
+
 # THE EXCEPTION HANDLERS
 
 
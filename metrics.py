@@ -0,0 +1,278 @@
+# PROMETHEUS METRICS
+# everything is kept in plain dicts of floats inside this process and rendered to the
+# Prometheus text format when /metrics is scraped. the request middleware, the SQL events
+# and the pool all run on the event loop thread (SQLAlchemy runs its sync code in a
+# greenlet on that same thread), so no locks are needed and recording a sample is a couple
+# of dict lookups and additions.
+# every uvicorn worker has its own numbers, scrape each worker or run a single one
+
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from dataclasses import dataclass, fields
+
+from sqlalchemy import event
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 50, 100)
+PREFIX = "blog_"
+
+
+def _format_labels(names: tuple[str, ...], values: tuple) -> str:
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        escaped = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        pairs.append(f'{name}="{escaped}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()):
+        self.name = PREFIX + name
+        self.help = help
+        self.labels = labels
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, *label_values, amount: float = 1) -> None:
+        self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def samples(self):
+        for label_values, value in self._values.items():
+            yield self.name, _format_labels(self.labels, label_values), value
+
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def set(self, *label_values, value: float) -> None:
+        self._values[label_values] = value
+
+
+class Histogram:
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = (), buckets=LATENCY_BUCKETS):
+        self.name = PREFIX + name
+        self.help = help
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        # label values -> [count per bucket (+Inf last), sum]
+        self._series: dict[tuple, list] = {}
+
+    def observe(self, *label_values, value: float) -> None:
+        series = self._series.get(label_values)
+        if series is None:
+            series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+        # counts are stored per bucket and only made cumulative when rendering
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def samples(self):
+        bucket_labels = (*self.labels, "le")
+        for label_values, (counts, total) in self._series.items():
+            cumulative = 0
+            for upper, count in zip((*self.buckets, float("inf")), counts):
+                cumulative += count
+                yield (
+                    f"{self.name}_bucket",
+                    _format_labels(bucket_labels, (*label_values, _format_value(upper))),
+                    cumulative,
+                )
+            labels = _format_labels(self.labels, label_values)
+            yield f"{self.name}_sum", labels, total
+            yield f"{self.name}_count", labels, cumulative
+
+
+class CallbackGauge:
+    """Gauge read when /metrics is scraped, callback returns {label values: value}."""
+
+    type = "gauge"
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...], callback):
+        self.name = PREFIX + name
+        self.help = help
+        self.labels = labels
+        self.callback = callback
+
+    def samples(self):
+        for label_values, value in self.callback().items():
+            yield self.name, _format_labels(self.labels, label_values), value
+
+
+class CallbackCounter(CallbackGauge):
+    type = "counter"
+
+
+_registry: list = []
+
+
+def register(metric):
+    _registry.append(metric)
+    return metric
+
+
+def register_stats(name: str, help: str, label: str, stats_type: type, callback) -> None:
+    """Export every field of a stats dataclass (all running totals) as a counter.
+
+    callback returns {label value: stats_type instance}, each field becomes
+    blog_<name>_<field>_total labelled with label
+    """
+    def field_callback(field_name):
+        return lambda: {
+            (label_value,): getattr(stats, field_name)
+            for label_value, stats in callback().items()
+        }
+
+    for stats_field in fields(stats_type):
+        metric_name = f"{name}_{stats_field.name}".removesuffix("_total") + "_total"
+        register(CallbackCounter(metric_name, f"{help}, {stats_field.name}", (label,), field_callback(stats_field.name)))
+
+
+def render() -> str:
+    """Everything registered, in the Prometheus text exposition format (version 0.0.4)."""
+    lines = []
+    for metric in _registry:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.type}")
+        for name, labels, value in metric.samples():
+            lines.append(f"{name}{labels} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+# HTTP REQUESTS
+# per route numbers everywhere (here, compress.py, the slow query log) are labelled with
+# the route's path template, so ids don't turn every post into its own series
+
+def route_label(scope) -> str:
+    """Path template of the route that handled a request, without the ids in it."""
+    route = scope.get("route")
+    if route is not None:
+        return route.path
+    # mounts (static files) don't set a route, their mount point is in root_path
+    return scope.get("root_path") or "<unmatched>"
+
+
+requests_total = register(Counter(
+    "http_requests_total", "Requests handled, by route template and status", ("method", "route", "status"),
+))
+request_duration = register(Histogram(
+    "http_request_duration_seconds", "Time from request start to the last body byte", ("method", "route"),
+))
+requests_in_flight = register(Gauge("http_requests_in_flight", "Requests currently being handled"))
+requests_in_flight.set(value=0)
+queries_per_request = register(Histogram(
+    "db_queries_per_request", "SQL statements executed per request", ("route",), buckets=QUERY_COUNT_BUCKETS,
+))
+db_seconds_per_request = register(Histogram(
+    "db_seconds_per_request", "Time spent executing SQL per request", ("route",),
+))
+
+
+@dataclass
+class _RequestQueries:
+    count: int = 0
+    seconds: float = 0.0
+
+
+# the middleware puts a fresh tracker here for every request, the SQL events add to it.
+# context vars follow the request into its dependencies and into SQLAlchemy's greenlets
+_current_queries: ContextVar[_RequestQueries | None] = ContextVar("current_queries", default=None)
+
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500  # if the app raises before sending anything, that's what the client gets
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        queries = _RequestQueries()
+        token = _current_queries.set(queries)
+        requests_in_flight.inc(amount=1)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            requests_in_flight.inc(amount=-1)
+            _current_queries.reset(token)
+            route = route_label(scope)  # filled in by the router while the request ran
+            method = scope["method"]
+            requests_total.inc(method, route, str(status_code))
+            request_duration.observe(method, route, value=elapsed)
+            queries_per_request.observe(route, value=queries.count)
+            db_seconds_per_request.observe(route, value=queries.seconds)
+
+
+# SQL
+
+query_duration = register(Histogram(
+    "db_query_duration_seconds", "SQL statement execution time", ("engine", "statement"),
+))
+pool_checkout_wait = register(Histogram(
+    "db_pool_checkout_wait_seconds", "Time spent waiting for a pooled connection", ("engine",),
+))
+
+_STATEMENT_KINDS = frozenset({
+    "SELECT", "INSERT", "UPDATE", "DELETE", "WITH", "PRAGMA", "CREATE", "DROP", "ALTER", "BEGIN", "COMMIT", "ROLLBACK",
+})
+
+
+def _statement_kind(statement: str) -> str:
+    # the statement text itself would make one series per query shape (and per IN list size)
+    kind = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else ""
+    return kind if kind in _STATEMENT_KINDS else "OTHER"
+
+
+def instrument_engine(async_engine, label: str) -> None:
+    """Time every statement run on an engine and count it against the current request."""
+
+    @event.listens_for(async_engine.sync_engine, "before_cursor_execute")
+    def _before(conn, _cursor, _statement, _parameters, _context, _executemany):
+        # a stack, not a single value: a statement may run another one before it finishes
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(async_engine.sync_engine, "after_cursor_execute")
+    def _after(conn, _cursor, statement, _parameters, _context, _executemany):
+        elapsed = time.perf_counter() - conn.info["query_started"].pop()
+        query_duration.observe(label, _statement_kind(statement), value=elapsed)
+        queries = _current_queries.get()
+        if queries is not None:
+            queries.count += 1
+            queries.seconds += elapsed
+
+
+def timed_pool_class(label: str) -> type[AsyncAdaptedQueuePool]:
+    """The default async pool, with the wait for a free connection recorded under label."""
+
+    class TimedAsyncAdaptedQueuePool(AsyncAdaptedQueuePool):
+        def _do_get(self):
+            # blocks (in the greenlet) until a connection is free or a new one may be opened
+            started = time.perf_counter()
+            try:
+                return super()._do_get()
+            finally:
+                pool_checkout_wait.observe(label, value=time.perf_counter() - started)
+
+    return TimedAsyncAdaptedQueuePool
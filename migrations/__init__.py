@@ -0,0 +1,154 @@
+# SCHEMA MIGRATIONS
+# the database remembers which migrations it has seen in schema_version, one row per
+# applied migration. MIGRATIONS below is the ordered list of every schema change since
+# the first release, a new change is a new mNNN_*.py module appended to it, never an edit
+# to an old one.
+# every script is idempotent (IF NOT EXISTS, column checks...): databases created by the
+# old create_all startup already have part of the schema and converge to the same result,
+# and a migration interrupted halfway is simply run again.
+#
+# on SQLite each migration runs in a BEGIN IMMEDIATE transaction on a connection of its own
+# (the pysqlite driver otherwise only opens transactions before DML, so DDL would commit
+# statement by statement and nothing would hold the write lock between reading the version
+# and recording it). the lock makes the other workers of a `uvicorn --workers N` start wait,
+# they then see the migration already applied and skip it.
+#
+# startup only runs one SELECT to compare versions. apply migrations ahead of a deploy with
+#   python -m migrations upgrade
+# and set AUTO_MIGRATE=false so workers never do schema work while serving traffic
+
+from dataclasses import dataclass
+from datetime import UTC, datetime
+from typing import Callable
+
+from sqlalchemy import event, text
+from sqlalchemy.exc import OperationalError, ProgrammingError
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import NullPool
+
+from config import settings
+from migrations import (
+    m001_baseline,
+    m002_feed_indexes,
+    m003_lower_indexes,
+    m004_search_index,
+    m005_user_stats,
+    m006_view_count,
+    m007_post_user_cascade,
+)
+
+
+@dataclass(frozen=True)
+class Migration:
+    version: int
+    name: str
+    upgrade: Callable  # takes a sync Connection, runs inside a transaction
+
+
+MIGRATIONS = (
+    Migration(1, "baseline", m001_baseline.upgrade),
+    Migration(2, "feed_indexes", m002_feed_indexes.upgrade),
+    Migration(3, "lower_indexes", m003_lower_indexes.upgrade),
+    Migration(4, "search_index", m004_search_index.upgrade),
+    Migration(5, "user_stats", m005_user_stats.upgrade),
+    Migration(6, "view_count", m006_view_count.upgrade),
+    Migration(7, "post_user_cascade", m007_post_user_cascade.upgrade),
+)
+LATEST_VERSION = MIGRATIONS[-1].version
+
+SCHEMA_VERSION_DDL = """
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY,
+        name VARCHAR(100) NOT NULL,
+        applied_at VARCHAR(40) NOT NULL
+    )
+"""
+
+
+def current_version(connection) -> int:
+    """Highest applied migration, 0 for a database that has never been migrated (sync connection)."""
+    try:
+        return connection.execute(text("SELECT max(version) FROM schema_version")).scalar() or 0
+    except (OperationalError, ProgrammingError):  # no schema_version table yet
+        return 0
+
+
+def _apply(connection, migration: Migration) -> bool:
+    # re-checked inside the transaction: another worker may have applied it in the meantime
+    if current_version(connection) >= migration.version:
+        return False
+    migration.upgrade(connection)
+    connection.execute(
+        text("INSERT INTO schema_version (version, name, applied_at) VALUES (:version, :name, :applied_at)"),
+        {
+            "version": migration.version,
+            "name": migration.name,
+            "applied_at": datetime.now(UTC).isoformat(timespec="seconds"),
+        },
+    )
+    return True
+
+
+def _migration_engine(engine):
+    """An engine whose transactions really are transactions, holding the write lock from BEGIN."""
+    if engine.dialect.name != "sqlite":
+        return engine  # transactional DDL already, nothing to fix
+
+    migration_engine = create_async_engine(
+        engine.url,
+        poolclass=NullPool,
+        # how long a worker waits for the one running the migrations
+        connect_args={"timeout": settings.migration_lock_timeout_seconds},
+    )
+
+    # SQLAlchemy's recipe for pysqlite: switch the driver's own transaction handling off
+    # and emit BEGIN ourselves
+    @event.listens_for(migration_engine.sync_engine, "connect")
+    def _no_implicit_transactions(dbapi_connection, _connection_record):
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(migration_engine.sync_engine, "begin")
+    def _begin_immediate(connection):
+        connection.exec_driver_sql("BEGIN IMMEDIATE")
+
+    return migration_engine
+
+
+async def upgrade_database(engine) -> list[Migration]:
+    """Apply every pending migration, each in its own locked transaction. Returns the ones applied."""
+    migration_engine = _migration_engine(engine)
+    applied = []
+    try:
+        async with migration_engine.begin() as conn:
+            await conn.execute(text(SCHEMA_VERSION_DDL))
+            version = await conn.run_sync(current_version)
+
+        for migration in MIGRATIONS:
+            if migration.version <= version:
+                continue
+            async with migration_engine.begin() as conn:
+                if await conn.run_sync(_apply, migration):
+                    applied.append(migration)
+    finally:
+        if migration_engine is not engine:
+            await migration_engine.dispose()
+    return applied
+
+
+async def check_schema(engine) -> None:
+    """Startup check: one query when the schema is current, migrate or refuse to start otherwise."""
+    async with engine.connect() as conn:
+        version = await conn.run_sync(current_version)
+    if version == LATEST_VERSION:
+        return
+    if version > LATEST_VERSION:
+        raise RuntimeError(
+            f"database schema is at version {version}, newer than this code ({LATEST_VERSION}): "
+            "deploy the matching code version",
+        )
+    if not settings.auto_migrate:
+        raise RuntimeError(
+            f"database schema is at version {version}, this code needs {LATEST_VERSION}: "
+            "run python -m migrations upgrade",
+        )
+    await upgrade_database(engine)
@@ -0,0 +1,33 @@
+# python -m migrations upgrade   apply every pending migration
+# python -m migrations status    show the current version and what is pending
+
+import asyncio
+import sys
+
+from database import engine
+from migrations import LATEST_VERSION, MIGRATIONS, current_version, upgrade_database
+
+
+async def _upgrade() -> None:
+    applied = await upgrade_database(engine)
+    await engine.dispose()
+    for migration in applied:
+        print(f"applied {migration.version:03d} {migration.name}")
+    print(f"schema is at version {LATEST_VERSION}" if applied else "schema already up to date")
+
+
+async def _status() -> None:
+    async with engine.connect() as conn:
+        version = await conn.run_sync(current_version)
+    await engine.dispose()
+    print(f"current version: {version}, latest: {LATEST_VERSION}")
+    for migration in MIGRATIONS:
+        state = "applied" if migration.version <= version else "pending"
+        print(f"  {migration.version:03d} {migration.name:<20} {state}")
+
+
+if __name__ == "__main__":
+    commands = {"upgrade": _upgrade, "status": _status}
+    if len(sys.argv) != 2 or sys.argv[1] not in commands:
+        sys.exit("usage: python -m migrations upgrade|status")
+    asyncio.run(commands[sys.argv[1]]())
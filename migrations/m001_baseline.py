@@ -0,0 +1,38 @@
+"""The schema as the first release created it with Base.metadata.create_all."""
+
+from sqlalchemy import text
+
+# frozen on purpose: later changes to models.py are new migrations, never edits here
+STATEMENTS = [
+    """
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER NOT NULL,
+        username VARCHAR(50) NOT NULL,
+        email VARCHAR(120) NOT NULL,
+        password_hash VARCHAR(200) NOT NULL,
+        image_file VARCHAR(200),
+        PRIMARY KEY (id),
+        UNIQUE (username),
+        UNIQUE (email)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_users_id ON users (id)",
+    """
+    CREATE TABLE IF NOT EXISTS posts (
+        id INTEGER NOT NULL,
+        title VARCHAR(100) NOT NULL,
+        content TEXT NOT NULL,
+        user_id INTEGER NOT NULL,
+        date_posted DATETIME NOT NULL,
+        PRIMARY KEY (id),
+        FOREIGN KEY(user_id) REFERENCES users (id)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_posts_id ON posts (id)",
+    "CREATE INDEX IF NOT EXISTS ix_posts_user_id ON posts (user_id)",
+]
+
+
+def upgrade(connection) -> None:
+    for statement in STATEMENTS:
+        connection.execute(text(statement))
@@ -0,0 +1,10 @@
+"""Composite indexes behind the keyset paginated feeds (global and per author)."""
+
+from sqlalchemy import text
+
+
+def upgrade(connection) -> None:
+    connection.execute(text("CREATE INDEX IF NOT EXISTS ix_posts_date_posted_id ON posts (date_posted, id)"))
+    connection.execute(
+        text("CREATE INDEX IF NOT EXISTS ix_posts_user_id_date_posted_id ON posts (user_id, date_posted, id)"),
+    )
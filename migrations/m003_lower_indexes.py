@@ -0,0 +1,9 @@
+"""Unique lower() expression indexes for the case-insensitive username/email lookups."""
+
+from sqlalchemy import text
+
+
+def upgrade(connection) -> None:
+    # fails if two existing accounts differ only by case, those have to be merged by hand first
+    connection.execute(text("CREATE UNIQUE INDEX IF NOT EXISTS ix_users_username_lower ON users (lower(username))"))
+    connection.execute(text("CREATE UNIQUE INDEX IF NOT EXISTS ix_users_email_lower ON users (lower(email))"))
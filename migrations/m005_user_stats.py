@@ -0,0 +1,36 @@
+"""Denormalized post_count / last_posted_at / total_chars on users, backfilled from posts."""
+
+from sqlalchemy import inspect, text
+
+# frozen copies of what stats.py did when this migration was written
+COLUMNS = {
+    "post_count": "INTEGER NOT NULL DEFAULT 0",
+    "last_posted_at": "DATETIME",
+    "total_chars": "INTEGER NOT NULL DEFAULT 0",
+}
+
+BACKFILL = """
+    UPDATE users
+    SET post_count = agg.post_count,
+        last_posted_at = agg.last_posted_at,
+        total_chars = agg.total_chars
+    FROM (
+        SELECT user_id,
+               count(*) AS post_count,
+               max(date_posted) AS last_posted_at,
+               sum(length(content)) AS total_chars
+        FROM posts
+        GROUP BY user_id
+    ) AS agg
+    WHERE agg.user_id = users.id
+"""
+
+
+def upgrade(connection) -> None:
+    existing = {column["name"] for column in inspect(connection).get_columns("users")}
+    for name, ddl in COLUMNS.items():
+        if name not in existing:
+            connection.execute(text(f"ALTER TABLE users ADD COLUMN {name} {ddl}"))
+    # then one grouped pass over posts
+    connection.execute(text("UPDATE users SET post_count = 0, last_posted_at = NULL, total_chars = 0"))
+    connection.execute(text(BACKFILL))
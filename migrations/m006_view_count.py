@@ -0,0 +1,10 @@
+"""posts.view_count, incremented in batches by views.py, and the index behind the most viewed list."""
+
+from sqlalchemy import inspect, text
+
+
+def upgrade(connection) -> None:
+    existing = {column["name"] for column in inspect(connection).get_columns("posts")}
+    if "view_count" not in existing:
+        connection.execute(text("ALTER TABLE posts ADD COLUMN view_count INTEGER NOT NULL DEFAULT 0"))
+    connection.execute(text("CREATE INDEX IF NOT EXISTS ix_posts_view_count_id ON posts (view_count, id)"))
@@ -0,0 +1,60 @@
+"""ON DELETE CASCADE on posts.user_id, so deleting a user removes their posts in the database."""
+
+from sqlalchemy import inspect, text
+
+# the posts table as of migration 6, with the cascading foreign key
+POSTS_DDL = """
+    CREATE TABLE posts_new (
+        id INTEGER NOT NULL,
+        title VARCHAR(100) NOT NULL,
+        content TEXT NOT NULL,
+        user_id INTEGER NOT NULL,
+        date_posted DATETIME NOT NULL,
+        view_count INTEGER DEFAULT 0 NOT NULL,
+        PRIMARY KEY (id),
+        FOREIGN KEY(user_id) REFERENCES users (id) ON DELETE CASCADE
+    )
+"""
+
+
+def _has_cascade(connection) -> bool:
+    return any(
+        fk["referred_table"] == "users" and (fk.get("options") or {}).get("ondelete", "").upper() == "CASCADE"
+        for fk in inspect(connection).get_foreign_keys("posts")
+    )
+
+
+def upgrade(connection) -> None:
+    if _has_cascade(connection):
+        return
+
+    if connection.dialect.name != "sqlite":
+        # everywhere else the constraint can simply be swapped
+        for fk in inspect(connection).get_foreign_keys("posts"):
+            if fk["referred_table"] == "users" and fk.get("name"):
+                connection.execute(text(f"ALTER TABLE posts DROP CONSTRAINT {fk['name']}"))
+        connection.execute(text(
+            "ALTER TABLE posts ADD CONSTRAINT posts_user_id_fkey "
+            "FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE",
+        ))
+        return
+
+    # SQLite can't alter a constraint, the table is rebuilt (https://sqlite.org/lang_altertable.html#otheralter)
+    # all of it inside the BEGIN IMMEDIATE transaction upgrade_database opens, so it either
+    # happens completely or not at all. the DROP only matters for a database left behind by
+    # an older, non transactional run of this script.
+    # rowids are copied as they are, so posts_fts (which indexes by rowid) stays valid.
+    # the indexes and the search triggers go away with the old table, their saved sql is replayed
+    connection.execute(text("DROP TABLE IF EXISTS posts_new"))
+    dependents = connection.execute(text(
+        "SELECT sql FROM sqlite_master WHERE tbl_name = 'posts' AND type IN ('index', 'trigger') AND sql IS NOT NULL",
+    )).scalars().all()
+    connection.execute(text(POSTS_DDL))
+    connection.execute(text(
+        "INSERT INTO posts_new (id, title, content, user_id, date_posted, view_count) "
+        "SELECT id, title, content, user_id, date_posted, view_count FROM posts",
+    ))
+    connection.execute(text("DROP TABLE posts"))  # the implicit delete doesn't fire the search triggers
+    connection.execute(text("ALTER TABLE posts_new RENAME TO posts"))
+    for sql in dependents:
+        connection.execute(text(sql))
@@ -2,12 +2,19 @@ from __future__ import annotations
 
 from datetime import UTC, datetime
 
-from sqlalchemy import DateTime, ForeignKey, Integer, String, Text
+from sqlalchemy import DateTime, ForeignKey, Index, Integer, String, Text, func
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 from database import Base
 
 
+def profile_image_path(image_file: str | None) -> str:
+    # shared with the queries that select plain columns instead of User objects
+    if image_file:
+        return f"/media/profile_pics/{image_file}"
+    return "/static/profile_pics/default.jpg"
+
+
 class User(Base):
     __tablename__ = "users"
 
@@ -32,20 +39,35 @@ class User(Base):
         # could be replaced with a default image if desired
     )
 
+    # denormalized stats, kept up to date by stats.apply_post_stats on every post write
+    # so profile pages never have to aggregate over posts
+    post_count: Mapped[int] = mapped_column(Integer, nullable=False, default=0, server_default="0")
+    last_posted_at: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), nullable=True, default=None)
+    total_chars: Mapped[int] = mapped_column(Integer, nullable=False, default=0, server_default="0")
+
     posts: Mapped[list[Post]] = relationship(
         back_populates="author",
         cascade="all, delete-orphan",
+        passive_deletes=True,
     )
     # back_populates links two related models
     # so the relationship works both ways
     # cascade ensures that when a user is deleted, their posts are also deleted to maintain data integrity
     # orphan means if a post is removed from the user's posts list, it will be deleted from the database as well
+    # passive_deletes leaves that to the ON DELETE CASCADE on posts.user_id instead of loading
+    # every post and deleting them one by one (see deletion.py)
 
     @property
     def image_path(self) -> str:
-        if self.image_file:
-            return f"/media/profile_pics/{self.image_file}"
-        return "/static/profile_pics/default.jpg"
+        return profile_image_path(self.image_file)
+
+
+# expression indexes for the case-insensitive lookups in routers/users.py
+# a WHERE lower(email) = ? can't use the plain unique index on email, it has to match
+# the indexed expression exactly. unique=True also makes "Alice" and "alice" collide
+# at the database level, not just in the registration check
+Index("ix_users_username_lower", func.lower(User.username), unique=True)
+Index("ix_users_email_lower", func.lower(User.email), unique=True)
 
 
 class Post(Base):
@@ -56,7 +78,7 @@ class Post(Base):
     content: Mapped[str] = mapped_column(Text, nullable=False)
 
     user_id: Mapped[int] = mapped_column(
-        ForeignKey("users.id"),
+        ForeignKey("users.id", ondelete="CASCADE"),
         nullable=False,
         index=True,
     )
@@ -66,4 +88,17 @@ class Post(Base):
         default=lambda: datetime.now(UTC),
     )
 
-    author: Mapped[User] = relationship(back_populates="posts")
\ No newline at end of file
+    # written by views.py in batches, never on the request path
+    view_count: Mapped[int] = mapped_column(Integer, nullable=False, default=0, server_default="0")
+
+    author: Mapped[User] = relationship(back_populates="posts")
+
+    __table_args__ = (
+        # composite indexes matching the feed sort order (date_posted DESC, id DESC)
+        # lets keyset pagination seek straight to the cursor instead of sorting the whole table
+        Index("ix_posts_date_posted_id", "date_posted", "id"),
+        # same thing for a single author's posts
+        Index("ix_posts_user_id_date_posted_id", "user_id", "date_posted", "id"),
+        # the most viewed list reads this backwards and stops after ?limit= entries
+        Index("ix_posts_view_count_id", "view_count", "id"),
+    )
\ No newline at end of file
@@ -0,0 +1,82 @@
+# KEYSET (CURSOR) PAGINATION FOR THE POST FEEDS
+# instead of OFFSET (which makes the database walk past every skipped row)
+# we remember the (date_posted, id) of the last post on the page and ask for
+# everything strictly "older" than that on the next request.
+# the composite index on posts(date_posted, id) makes this a straight index seek,
+# so page 1000 costs the same as page 1
+
+import base64
+import binascii
+import json
+from datetime import datetime
+
+from fastapi import HTTPException, status
+from sqlalchemy import Select, tuple_
+
+import models
+
+
+def invalid_cursor() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        detail="Invalid cursor",
+    )
+
+
+def encode_key(values: list) -> str:
+    """Pack a JSON-serializable sort key into an opaque, url safe cursor."""
+    raw = json.dumps(values, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+    # stripping the "=" padding keeps the cursor clean in query strings
+
+
+def decode_key(cursor: str) -> list:
+    """Unpack a cursor produced by encode_key, raising 400 if it was tampered with."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded))
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        # json.JSONDecodeError is a subclass of ValueError
+        raise invalid_cursor()
+    if not isinstance(values, list):
+        raise invalid_cursor()
+    return values
+
+
+def encode_cursor(date_posted: datetime, post_id: int) -> str:
+    """Encode the sort key of the last post on a page into an opaque cursor."""
+    return encode_key([date_posted.isoformat(), post_id])
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, int]:
+    """Decode a cursor produced by encode_cursor."""
+    try:
+        date_str, post_id = decode_key(cursor)
+        return datetime.fromisoformat(date_str), int(post_id)
+    except (ValueError, TypeError):
+        raise invalid_cursor()
+
+
+def paginate_posts(query: Select, cursor: str | None, limit: int) -> Select:
+    """Apply the feed ordering, the cursor filter and the page limit to a posts query."""
+    if cursor is not None:
+        date_posted, post_id = decode_cursor(cursor)
+        # row value comparison, SQLite turns this into a range scan on the composite index
+        query = query.where(
+            tuple_(models.Post.date_posted, models.Post.id) < tuple_(date_posted, post_id),
+        )
+
+    return query.order_by(
+        models.Post.date_posted.desc(),
+        models.Post.id.desc(),  # tie breaker so posts with the same timestamp are never skipped
+    ).limit(limit + 1)  # one extra row tells us whether there is a next page
+
+
+def split_page(posts: list, limit: int) -> tuple[list, str | None]:
+    """Trim the extra lookahead row and build the cursor for the next page."""
+    if len(posts) <= limit:
+        return posts, None
+
+    posts = posts[:limit]
+    last = posts[-1]
+    return posts, encode_cursor(last.date_posted, last.id)
@@ -0,0 +1,104 @@
+# ON DEMAND REQUEST PROFILING
+# send a request with "X-Profile: <settings.profile_token>" and it runs under cProfile.
+# the response carries an X-Profile-Id header, the profile itself is written to
+# settings.profile_dir as <id>.pstats and can be read back from /debug/profiles/<id>
+# (same header needed) or opened locally with python -m pstats / snakeviz.
+#
+# cProfile sees the whole event loop thread, so anything else running concurrently ends
+# up in the profile too: profile on a quiet worker. only one request is profiled at a
+# time, while one is running the header is ignored (the response says X-Profile: busy)
+
+import cProfile
+import hmac
+import io
+import pstats
+import re
+import time
+import uuid
+from pathlib import Path
+from typing import Annotated
+
+from fastapi import Header, HTTPException, status
+from starlette.datastructures import Headers, MutableHeaders
+
+from config import settings
+
+PROFILE_DIR = Path(settings.profile_dir)
+_PROFILE_ID = re.compile(r"^\d+-[0-9a-f]{8}$")
+
+_profiling = False  # cProfile can't run two profilers at once in one thread
+
+
+def token_matches(value: str | None) -> bool:
+    if settings.profile_token is None or not value:
+        return False
+    # constant time, so the token can't be guessed byte by byte from response times
+    return hmac.compare_digest(value.encode(), settings.profile_token.get_secret_value().encode())
+
+
+def require_profile_token(x_profile: Annotated[str | None, Header()] = None) -> None:
+    """Dependency for the debug routes, they don't exist unless profiling is configured."""
+    if settings.profile_token is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+    if not token_matches(x_profile):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Invalid profile token")
+
+
+def profile_path(profile_id: str) -> Path:
+    if not _PROFILE_ID.match(profile_id):  # ids end up in a file path
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Profile not found")
+    path = PROFILE_DIR / f"{profile_id}.pstats"
+    if not path.exists():
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Profile not found")
+    return path
+
+
+def profile_report(path: Path, limit: int = 60) -> str:
+    """Text report of a stored profile, most expensive calls (cumulative time) first."""
+    out = io.StringIO()
+    stats = pstats.Stats(str(path), stream=out)
+    stats.strip_dirs().sort_stats("cumulative").print_stats(limit)
+    return out.getvalue()
+
+
+class ProfilingMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        global _profiling
+
+        if scope["type"] != "http" or settings.profile_token is None:
+            await self.app(scope, receive, send)
+            return
+        if not token_matches(Headers(scope=scope).get("x-profile")):
+            await self.app(scope, receive, send)
+            return
+
+        if _profiling:
+            async def send_busy(message):
+                if message["type"] == "http.response.start":
+                    MutableHeaders(scope=message)["X-Profile"] = "busy"
+                await send(message)
+
+            await self.app(scope, receive, send_busy)
+            return
+
+        profile_id = f"{int(time.time())}-{uuid.uuid4().hex[:8]}"
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                # the profile isn't written yet at this point, it is by the time the client reads the id
+                MutableHeaders(scope=message)["X-Profile-Id"] = profile_id
+            await send(message)
+
+        profiler = cProfile.Profile()
+        _profiling = True
+        profiler.enable()
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            profiler.disable()
+            _profiling = False
+            PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+            profiler.dump_stats(PROFILE_DIR / f"{profile_id}.pstats")
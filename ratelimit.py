@@ -0,0 +1,110 @@
+# LOGIN THROTTLING
+# every login attempt costs a full argon2 verify (tens of ms of CPU), so a credential
+# stuffing burst can pin every core. attempts go through two token buckets first, one
+# keyed by client IP and one by the (lowercased) email being tried, and past either limit
+# we answer 429 with Retry-After without touching the database or the hasher.
+#
+# a bucket holds up to `burst` attempts and refills at `per_minute`. buckets live in a
+# bounded LRU: a key that has been idle long enough to refill completely is no different
+# from a key we have never seen, so it's dropped, and when max_keys is reached the least
+# recently used key goes first. like the caches, this is per process and lock free
+# (it only runs on the event loop thread)
+#
+# behind a reverse proxy run uvicorn with --proxy-headers (and --forwarded-allow-ips),
+# otherwise every request looks like it comes from the proxy
+
+import math
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from fastapi import HTTPException, Request, status
+
+from config import settings
+
+
+@dataclass
+class RateLimitStats:
+    allowed: int = 0
+    rejected: int = 0
+    evictions: int = 0  # keys pushed out because max_keys was reached
+    expirations: int = 0  # idle keys dropped after refilling completely
+
+
+class TokenBucketLimiter:
+    """Per key token buckets in a bounded LRU with idle expiry."""
+
+    def __init__(self, name: str, burst: int, per_minute: float, max_keys: int):
+        self.name = name
+        self.burst = burst
+        self.rate = per_minute / 60  # tokens per second
+        self.max_keys = max_keys
+        self.idle_seconds = burst / self.rate  # time for an empty bucket to fill up again
+        self.stats = RateLimitStats()
+        self._buckets: OrderedDict[str, list[float]] = OrderedDict()  # key -> [tokens, updated_at]
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def _expire(self, now: float) -> None:
+        # every touch moves a key to the back, so the front is always the longest idle one
+        while self._buckets:
+            key, (_tokens, updated_at) = next(iter(self._buckets.items()))
+            if now - updated_at < self.idle_seconds:
+                break
+            del self._buckets[key]
+            self.stats.expirations += 1
+
+    def acquire(self, key: str) -> float:
+        """Take one token for key. Returns 0 if allowed, otherwise the seconds until a token is free."""
+        now = time.monotonic()
+        self._expire(now)
+
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if len(self._buckets) >= self.max_keys:
+                self._buckets.popitem(last=False)
+                self.stats.evictions += 1
+            bucket = self._buckets[key] = [float(self.burst), now]
+        else:
+            self._buckets.move_to_end(key)
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            self.stats.allowed += 1
+            return 0.0
+        self.stats.rejected += 1
+        return (1 - bucket[0]) / self.rate
+
+
+login_ip_limiter = TokenBucketLimiter(
+    "login_ip",
+    burst=settings.login_ip_burst,
+    per_minute=settings.login_ip_per_minute,
+    max_keys=settings.ratelimit_max_keys,
+)
+login_email_limiter = TokenBucketLimiter(
+    "login_email",
+    burst=settings.login_email_burst,
+    per_minute=settings.login_email_per_minute,
+    max_keys=settings.ratelimit_max_keys,
+)
+limiters = (login_ip_limiter, login_email_limiter)
+
+
+def throttle_login(request: Request, email: str) -> None:
+    """Raise 429 if this client or this account has run out of login attempts."""
+    client_ip = request.client.host if request.client else "unknown"
+    retry_after = login_ip_limiter.acquire(client_ip)
+    if not retry_after:
+        # only counts against the account once the IP check passed, so one noisy IP
+        # can't lock a victim's account out by itself faster than its own limit allows
+        retry_after = login_email_limiter.acquire(email.lower())
+    if retry_after:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many login attempts, please try again later",
+            headers={"Retry-After": str(math.ceil(retry_after))},
+        )
@@ -1,30 +1,97 @@
 # IMPORTS FOR POST ROUTERS
+from datetime import UTC, datetime
 from typing import Annotated
 
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy import select
+from fastapi import APIRouter, Body, Depends, HTTPException, Query, Response, status
+from sqlalchemy import insert, select
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import selectinload
 
 import models
-from database import get_db
-from schemas import PostCreate, PostResponse, PostUpdate
-
-from auth import Current_User
+from cache import bump_content_version, invalidate_author, post_cache
+from config import settings
+from database import get_db, get_read_db
+from exports import ExportFormat, export_posts_response
+from feeds import fetch_most_viewed, fetch_summary_page, parse_fields, summary_list_response, summary_page_response
+from schemas import PostBulkResult, PostCreate, PostResponse, PostSearchPage, PostSummary, PostSummaryPage, PostUpdate
+from search import search_posts
+from stats import apply_post_stats
+from views import view_counter
+
+from auth import Current_User, user_not_found
 
 router = APIRouter()  # this is what will decorate our apps instead of the main app, allows us to organize our code better and separate concerns
 
 
-@router.get("", response_model=list[PostResponse])
-async def get_posts(db: Annotated[AsyncSession, Depends(get_db)]):
+async def get_post_json(db: AsyncSession, post_id: int) -> bytes | None:
+    """Return the serialized PostResponse for a post, going through the post cache."""
+    payload = post_cache.get(post_id)
+    if payload is not None:
+        return payload
+
+    stamp = post_cache.stamp()  # taken before the query, see LRUCache.set
     result = await db.execute(
         select(models.Post)
         .options(selectinload(models.Post.author))
-        .order_by(models.Post.date_posted.desc()),
-    )  # eager loading author details with each post, also ordering by most recent posts first
-    # .order_by(models.Post.date_posted.desc()) --> ordering posts by descending order
-    posts = result.scalars().all()
-    return posts
+        .where(models.Post.id == post_id),
+    )
+
+    post = result.scalars().first()
+    if not post:
+        return None
+
+    payload = PostResponse.model_validate(post).model_dump_json().encode()
+    post_cache.set(post_id, payload, tags=(("author", post.user_id),), stamp=stamp)
+    return payload
+
+
+def _author_gone(user_id: int) -> HTTPException:
+    # posts.user_id is the only constraint an insert can break, so the account was deleted
+    # through another worker while this one still had it in user_cache
+    invalidate_author(user_id)
+    return user_not_found()
+
+
+@router.get("", response_model=PostSummaryPage)
+async def get_posts(
+    db: Annotated[AsyncSession, Depends(get_read_db)],
+    cursor: str | None = None,
+    limit: Annotated[int, Query(ge=1, le=settings.max_posts_per_page)] = settings.posts_per_page,
+    fields: Annotated[str | None, Query(description="Comma separated PostSummary fields to return")] = None,
+):
+    requested = parse_fields(fields)  # 400 on unknown fields, before touching the database
+    # summaries with the author joined in, newest first, one page at a time
+    page = await fetch_summary_page(db, cursor, limit)
+    return summary_page_response(page, requested)
+
+
+@router.get("/export")
+async def export_posts(format: ExportFormat = "ndjson"):
+    # declared before /{post_id} so "export" isn't parsed as a post id
+    # streams every post, for the nightly archive jobs, instead of paging through get_posts
+    return export_posts_response(format)
+
+
+@router.get("/search", response_model=PostSearchPage)
+async def search(
+    q: Annotated[str, Query(min_length=1, max_length=200)],
+    db: Annotated[AsyncSession, Depends(get_read_db)],
+    cursor: str | None = None,
+    limit: Annotated[int, Query(ge=1, le=settings.max_posts_per_page)] = settings.posts_per_page,
+):
+    # also has to come before /{post_id}
+    return await search_posts(db, q, cursor, limit)
+
+
+@router.get("/popular", response_model=list[PostSummary])
+async def most_viewed(
+    db: Annotated[AsyncSession, Depends(get_read_db)],
+    limit: Annotated[int, Query(ge=1, le=settings.max_posts_per_page)] = settings.posts_per_page,
+):
+    # before /{post_id} as well. ranks on the flushed counters, an index walk instead of
+    # counting views per request
+    return summary_list_response(await fetch_most_viewed(db, limit))
 
 
 @router.post(
@@ -44,23 +111,74 @@ async def create_post(
     )
 
     db.add(new_post)
+    try:
+        await db.flush()  # the INSERT has to land first, last_posted_at is read back from posts
+    except IntegrityError:
+        raise _author_gone(current_user.id)
+    await apply_post_stats(db, current_user.id, post_delta=1, chars_delta=len(post.content))
     await db.commit()
+    invalidate_author(current_user.id)  # the author's counters changed
+    bump_content_version()  # the new post shows up on the feed pages
     await db.refresh(new_post, attribute_names=["author"])
     return new_post
 
 
-@router.get("/{post_id}", response_model=PostResponse)
-async def get_post(post_id: int, db: Annotated[AsyncSession, Depends(get_db)]):
-    result = await db.execute(
-        select(models.Post)
-        .options(selectinload(models.Post.author))
-        .where(models.Post.id == post_id),
+@router.post(
+    "/bulk",
+    response_model=PostBulkResult,
+    status_code=status.HTTP_201_CREATED,
+)
+async def create_posts_bulk(
+    posts: Annotated[list[PostCreate], Body(min_length=1, max_length=settings.bulk_max_posts)],
+    current_user: Current_User,
+    db: Annotated[AsyncSession, Depends(get_db)],
+):
+    # the whole list is validated by pydantic before we get here, one bad item rejects
+    # the request with a 422 listing every error (with its index), nothing is half inserted
+    date_posted = datetime.now(UTC)
+
+    # Core INSERT ... RETURNING for the whole list, SQLAlchemy batches the rows into a few
+    # multi-row VALUES statements. one transaction and one commit instead of one per post.
+    # (sort_by_parameter_order=True would make SQLite fall back to one statement per row)
+    try:
+        result = await db.execute(
+            insert(models.Post.__table__).returning(models.Post.id),
+            [
+                {
+                    "title": post.title,
+                    "content": post.content,
+                    "user_id": current_user.id,
+                    "date_posted": date_posted,
+                }
+                for post in posts
+            ],
+        )
+    except IntegrityError:
+        raise _author_gone(current_user.id)
+    # RETURNING rows come back in no guaranteed order, but SQLite hands out rowids in
+    # VALUES order while we hold the write lock, so sorted ids line up with the request
+    ids = sorted(result.scalars())
+    await apply_post_stats(
+        db,
+        current_user.id,
+        post_delta=len(ids),
+        chars_delta=sum(len(post.content) for post in posts),
     )
+    await db.commit()
+    invalidate_author(current_user.id)
+    bump_content_version()
 
-    post = result.scalars().first()
+    return PostBulkResult(ids=ids)
 
-    if post:
-        return post
+
+@router.get("/{post_id}", response_model=PostResponse)
+async def get_post(post_id: int, db: Annotated[AsyncSession, Depends(get_read_db)]):
+    payload = await get_post_json(db, post_id)
+
+    if payload:
+        view_counter.record(post_id)  # buffered, written out by views.py in batches
+        # already serialized, returning a Response skips response_model validation
+        return Response(content=payload, media_type="application/json")
 
     raise HTTPException(
         status_code=status.HTTP_404_NOT_FOUND,
@@ -93,11 +211,18 @@ async def update_post_full(
             detail="Not authorized to update this post",
         )
 
+    chars_delta = len(post_data.content) - len(post.content)
     post.title = post_data.title
     post.content = post_data.content
     # post.user_id = post_data.user_id
 
+    if chars_delta:
+        await apply_post_stats(db, post.user_id, chars_delta=chars_delta)
     await db.commit()
+    post_cache.invalidate(post_id)  # after the commit, so nobody re-caches the old row
+    if chars_delta:
+        invalidate_author(post.user_id)
+    bump_content_version()
     await db.refresh(post, attribute_names=["author"])
 
     return post
@@ -133,10 +258,18 @@ async def update_post_partial(
     # exclude_unset=True essentially makes sure pydantic only includes
     # the field specified by the user to be updated in the patch method
 
+    chars_delta = len(update_data["content"]) - len(post.content) if "content" in update_data else 0
+
     for field, value in update_data.items():
         setattr(post, field, value)
 
+    if chars_delta:
+        await apply_post_stats(db, post.user_id, chars_delta=chars_delta)
     await db.commit()
+    post_cache.invalidate(post_id)
+    if chars_delta:
+        invalidate_author(post.user_id)
+    bump_content_version()
     await db.refresh(post, attribute_names=["author"])
 
     return post
@@ -166,4 +299,9 @@ async def delete_post(
         )
 
     await db.delete(post)
-    await db.commit()
\ No newline at end of file
+    await db.flush()  # gone before apply_post_stats recomputes last_posted_at
+    await apply_post_stats(db, post.user_id, post_delta=-1, chars_delta=-len(post.content))
+    await db.commit()
+    post_cache.invalidate(post_id)
+    invalidate_author(post.user_id)
+    bump_content_version()
\ No newline at end of file
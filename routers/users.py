@@ -1,21 +1,27 @@
 #IMPORTS FOR USER ROUTERS
 from typing import Annotated
 
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy import func, select
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query, Request, Response, UploadFile, status
+from sqlalchemy import func, or_, select
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.orm import selectinload
 
+import deletion
 import models
-from database import get_db
-from schemas import PostResponse, Token, UserCreate, UserPublic, UserPrivate, UserUpdate
+from cache import bump_content_version, invalidate_author
+from database import get_db, get_read_db
+from exports import ExportFormat, export_posts_response
+from feeds import fetch_summary_page, parse_fields, summary_page_response
+from images import save_profile_picture
+from ratelimit import throttle_login
+from schemas import PostSummaryPage, Token, UserCreate, UserPublic, UserPrivate, UserUpdate
 #NOTE: USERPUBLIC ON ROUTES WHICH PUBLIC CAN SEE 
 # USERPRIVATE ON ROUTES WHEN I ONLY EXPECT LOGGED IN USERS TO GET A RESPONSE
 
 #shit needed for getting authentication running
 from datetime import timedelta
 from fastapi.security import OAuth2PasswordRequestForm
-from auth import Current_User, create_access_token, hash_password, verify_password, oauth2_scheme, verify_access_token
+from auth import Current_User, create_access_token, hash_password_async, verify_password_async, oauth2_scheme, verify_access_token
 
 from config import settings
 
@@ -33,42 +39,64 @@ router = APIRouter()
 )
 async def create_user(user: UserCreate, db: Annotated[AsyncSession, Depends(get_db)]):
     # dependency injection: we request a DB session via Depends(get_db)
+    username = user.username.lower()
+    email = user.email.lower()
+
+    # one query for both checks, each OR branch is served by its lower() expression index
+    # the max() aggregates tell us which of the two fields is taken (NULL when nobody matched)
     result = await db.execute(
-        select(models.User).where(func.lower(models.User.username) == user.username.lower()), #func adds the functionality to do .lowercase
+        select(
+            func.max(func.lower(models.User.username) == username).label("username_taken"),  #func adds the functionality to do .lowercase
+            func.max(func.lower(models.User.email) == email).label("email_taken"),
+        ).where(
+            or_(
+                func.lower(models.User.username) == username,
+                func.lower(models.User.email) == email,
+            ),
+        ),
     )
-    # scalars extracts the actual user object
-    existing_user = result.scalars().first()
-    if existing_user:
+    conflict = result.one()
+    if conflict.username_taken:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Username already exists",
         )
-
-    result = await db.execute(
-        select(models.User).where(func.lower(models.User.email) == user.email.lower()), #difference between func.lower and .lower()
-    )
-    existing_email = result.scalars().first()
-    if existing_email:
+    if conflict.email_taken:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Email already registered",
         )
 
+    # give the writer connection back to the pool while argon2 runs
+    await db.rollback()
+
     new_user = models.User(
         username=user.username,
-        email=user.email.lower(),
-        password_hash= hash_password(user.password),  # hash the password before storing
+        email=email,
+        password_hash=await hash_password_async(user.password),  # hash the password before storing, off the event loop
     )
     db.add(new_user)  # stages insert
-    await db.commit()  # executes insert
+    try:
+        await db.commit()  # executes insert
+    except IntegrityError:
+        # someone registered the same name/email between our check and the insert,
+        # the unique lower() indexes catch it
+        await db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Username or email already registered",
+        )
     await db.refresh(new_user)  # refresh to get id
     return new_user
 
 @router.post("/token", response_model=Token)
 async def login_for_access_token(
+    request: Request,
     form_data: Annotated[OAuth2PasswordRequestForm, Depends()],
-    db: Annotated[AsyncSession, Depends(get_db)],
+    db: Annotated[AsyncSession, Depends(get_read_db)],  # login only reads
 ):
+    throttle_login(request, form_data.username)  # before the query and the argon2 verify
+
     # Look up user by email (case-insensitive)
     # Note: OAuth2PasswordRequestForm uses "username" field, but we treat it as email
     result = await db.execute(
@@ -80,7 +108,7 @@ async def login_for_access_token(
 
     # Verify user exists and password is correct
     # Don't reveal which one failed (security best practice)
-    if not user or not verify_password(form_data.password, user.password_hash):
+    if not user or not await verify_password_async(form_data.password, user.password_hash):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password",
@@ -133,7 +161,7 @@ async def get_current_user(
 
 
 @router.get("/{user_id}", response_model=UserPublic)
-async def get_user(user_id: int, db: Annotated[AsyncSession, Depends(get_db)]):
+async def get_user(user_id: int, db: Annotated[AsyncSession, Depends(get_read_db)]):
     result = await db.execute(select(models.User).where(models.User.id == user_id))
     user = result.scalars().first()
     if user:
@@ -141,24 +169,39 @@ async def get_user(user_id: int, db: Annotated[AsyncSession, Depends(get_db)]):
     raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
 
 
-@router.get("/{user_id}/posts", response_model=list[PostResponse])
-async def get_user_posts(user_id: int, db: Annotated[AsyncSession, Depends(get_db)]):
-    result = await db.execute(select(models.User).where(models.User.id == user_id))
-    user = result.scalars().first()
-    if not user:
+@router.get("/{user_id}/posts", response_model=PostSummaryPage)
+async def get_user_posts(
+    user_id: int,
+    db: Annotated[AsyncSession, Depends(get_read_db)],
+    cursor: str | None = None,
+    limit: Annotated[int, Query(ge=1, le=settings.max_posts_per_page)] = settings.posts_per_page,
+    fields: Annotated[str | None, Query(description="Comma separated PostSummary fields to return")] = None,
+):
+    requested = parse_fields(fields)
+    result = await db.execute(select(models.User.id).where(models.User.id == user_id))
+    if result.scalar_one_or_none() is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="User not found",
         )
-    result = await db.execute(
-        select(models.Post)
-        .options(selectinload(models.Post.author))
-        .where(models.Post.user_id == user_id)
-        .order_by(models.Post.date_posted.desc()),
-    )
-    # figure out when to use selectinload
-    posts = result.scalars().all()
-    return posts
+    page = await fetch_summary_page(db, cursor, limit, user_id=user_id)
+    return summary_page_response(page, requested)
+
+
+@router.get("/{user_id}/posts/export")
+async def export_user_posts(
+    user_id: int,
+    db: Annotated[AsyncSession, Depends(get_read_db)],
+    format: ExportFormat = "ndjson",
+):
+    result = await db.execute(select(models.User.id).where(models.User.id == user_id))
+    if result.scalar_one_or_none() is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="User not found",
+        )
+    # has to 404 before streaming starts, once the body is going out the status is fixed
+    return export_posts_response(format, user_id=user_id)
 
 
 @router.patch("/{user_id}", response_model=UserPrivate)
@@ -190,7 +233,7 @@ async def update_user(
         and user_update.username.lower() != user.username.lower()
     ):
         result = await db.execute(
-            select(models.User).where(func.lower(models.User.username) == user_update.username.lower()),
+            select(models.User.id).where(func.lower(models.User.username) == user_update.username.lower()),  # id only, answered from the index
         )
         existing_user = result.scalars().first()
         if existing_user:
@@ -204,7 +247,7 @@ async def update_user(
         and user_update.email.lower() != user.email.lower()
     ):
         result = await db.execute(
-            select(models.User).where(func.lower(models.User.email) == user_update.email.lower()),
+            select(models.User.id).where(func.lower(models.User.email) == user_update.email.lower()),
         )
         existing_email = result.scalars().first()
         if existing_email:
@@ -220,16 +263,66 @@ async def update_user(
     if user_update.image_file is not None:
         user.image_file = user_update.image_file
 
+    try:
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Username or email already registered",
+        )
+    invalidate_author(user_id)  # cached posts embed the author's username and picture
+    bump_content_version()
+    await db.refresh(user)
+    return user
+
+
+@router.put("/{user_id}/picture", response_model=UserPrivate)
+async def upload_profile_picture(
+    user_id: int,
+    file: UploadFile,
+    current_user: Current_User,
+    db: Annotated[AsyncSession, Depends(get_db)],
+):
+    if user_id != current_user.id:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Not authorized to update this user",
+        )
+
+    # resize first, the session hasn't touched the database yet so no connection is held
+    # while the picture is processed
+    image_file = await save_profile_picture(file)
+
+    result = await db.execute(select(models.User).where(models.User.id == user_id))
+    user = result.scalars().first()
+
+    if not user:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="User not found",
+        )
+
+    # the old picture stays on disk, with content addressed names another user may share it
+    user.image_file = image_file
     await db.commit()
+    invalidate_author(user_id)
+    bump_content_version()
     await db.refresh(user)
     return user
 
 
-@router.delete("/{user_id}", status_code=status.HTTP_204_NO_CONTENT)
+@router.delete(
+    "/{user_id}",
+    status_code=status.HTTP_204_NO_CONTENT,
+    responses={status.HTTP_202_ACCEPTED: {"description": "Deletion started in the background"}},
+)
 async def delete_user(
     user_id: int,
     current_user: Current_User, 
-    db: Annotated[AsyncSession, Depends(get_db)]
+    db: Annotated[AsyncSession, Depends(get_read_db)],
+    background_tasks: BackgroundTasks,
+    background: Annotated[bool, Query(description="Answer 202 right away and delete in the background")] = False,
 ):    
     if user_id != current_user.id:
         raise HTTPException(
@@ -237,14 +330,19 @@ async def delete_user(
             detail="Not authorized to delete this user",
         )
 
-    result = await db.execute(select(models.User).where(models.User.id == user_id))
-    user = result.scalars().first()
+    # read session: the deletion batches need the writer connection for themselves
+    result = await db.execute(select(models.User.id).where(models.User.id == user_id))
 
-    if not user:
+    if result.scalar() is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="User not found",
         )
 
-    await db.delete(user)
-    await db.commit()
\ No newline at end of file
+    if background:
+        deletion.in_progress.add(user_id)  # locked out from now on, not once the task starts
+        background_tasks.add_task(deletion.delete_account_in_background, user_id)
+        return Response(status_code=status.HTTP_202_ACCEPTED)
+
+    # set-based batches instead of loading every post, see deletion.py
+    await deletion.delete_account(user_id)
\ No newline at end of file
@@ -23,6 +23,9 @@ class UserPublic(BaseModel):  # where is BaseModel coming from??
     username: str
     image_file: str | None
     image_path: str
+    post_count: int
+    last_posted_at: datetime | None
+    total_chars: int  # characters of post content written, across all posts
 
 
 class UserPrivate(UserPublic):
@@ -49,6 +52,10 @@ class PostBase(BaseModel):
 class PostCreate(PostBase):
     pass
 
+class PostBulkResult(BaseModel):
+    ids: list[int]  # ids of the created posts, in the same order as the request body
+
+
 class PostUpdate(BaseModel):
     title: str | None = Field(default=None, min_length=1, max_length=100)
     content: str | None = Field(default=None, min_length=1)
@@ -60,12 +67,47 @@ class PostResponse(PostBase):
     id: int
     user_id: int
     date_posted: datetime
+    view_count: int  # flushed views, lags by up to views_flush_interval_seconds + post_cache_ttl_seconds
     author: UserPublic
     # nested response model
     # allows returning author details with the post
     # useful for showing username/profile picture on frontend
 
 
+class PostSummary(BaseModel):
+    # what the feeds return: everything except the full content
+    id: int
+    title: str
+    excerpt: str  # first post_excerpt_length characters of the content, cut in SQL
+    truncated: bool  # True when the content is longer than the excerpt
+    user_id: int
+    date_posted: datetime
+    view_count: int
+    author: UserPublic
+
+
+class PostSummaryPage(BaseModel):
+    # one page of a post feed
+    # next_cursor is opaque to clients, pass it back as ?cursor= to get the next page
+    # it is None on the last page
+    posts: list[PostSummary]
+    next_cursor: str | None
+
+
+class PostSearchResult(BaseModel):
+    id: int
+    title: str
+    snippet: str  # html safe: text is escaped, matches are wrapped in <mark></mark>
+    user_id: int
+    date_posted: datetime
+    author: UserPublic
+
+
+class PostSearchPage(BaseModel):
+    results: list[PostSearchResult]  # best match first (bm25)
+    next_cursor: str | None
+
+
 # request → pydantic validates it
 # → SQLAlchemy stores/retrieves data
 # → pydantic formats the response
@@ -0,0 +1,182 @@
+# FULL TEXT SEARCH OVER POSTS (SQLite FTS5)
+# posts_fts is an "external content" FTS5 table: it only stores the search index,
+# the text itself stays in posts and is looked up by rowid (= posts.id).
+# triggers on posts keep the index in sync on every insert/update/delete, whichever
+# code path does the write (ORM, bulk insert, cascade delete...)
+#
+# the table and triggers come with migration 4.
+# to re-index from scratch: python -m search rebuild
+
+import asyncio
+import re
+import sys
+
+from markupsafe import escape
+from sqlalchemy import column, func, literal_column, select, table, text, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import models
+from config import settings
+from database import engine
+from feeds import AUTHOR_COLUMNS, author_from_row
+from pagination import decode_key, encode_key, invalid_cursor
+from schemas import PostSearchPage, PostSearchResult, UserPublic
+
+SEARCH_INDEX_DDL = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS posts_fts USING fts5(
+        title,
+        content,
+        content='posts',
+        content_rowid='id',
+        tokenize='porter unicode61'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS posts_fts_after_insert AFTER INSERT ON posts BEGIN
+        INSERT INTO posts_fts(rowid, title, content) VALUES (new.id, new.title, new.content);
+    END
+    """,
+    # external content tables are updated by deleting the old row and inserting the new one
+    """
+    CREATE TRIGGER IF NOT EXISTS posts_fts_after_delete AFTER DELETE ON posts BEGIN
+        INSERT INTO posts_fts(posts_fts, rowid, title, content) VALUES ('delete', old.id, old.title, old.content);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS posts_fts_after_update AFTER UPDATE OF title, content ON posts BEGIN
+        INSERT INTO posts_fts(posts_fts, rowid, title, content) VALUES ('delete', old.id, old.title, old.content);
+        INSERT INTO posts_fts(rowid, title, content) VALUES (new.id, new.title, new.content);
+    END
+    """,
+]
+
+
+def create_search_index(connection) -> None:
+    """Create the FTS table and its sync triggers if they don't exist (sync connection)."""
+    for statement in SEARCH_INDEX_DDL:
+        connection.execute(text(statement))
+
+
+def rebuild_search_index(connection) -> None:
+    """Create the index if needed and re-index every post from scratch (sync connection)."""
+    create_search_index(connection)
+    connection.execute(text("INSERT INTO posts_fts(posts_fts) VALUES ('rebuild')"))
+
+
+# QUERYING
+# posts_fts isn't a model (migration 4 creates it), a lightweight table() construct is
+# enough to select from it
+posts_fts = table("posts_fts", column("rowid"))
+_fts = literal_column("posts_fts")  # the table name doubles as a column in MATCH / bm25() / snippet()
+
+# snippet() wraps matches in these control characters, we escape the text and then swap
+# them for <mark> tags, so post content can never inject html through the snippet
+_MARK_START = "\x02"
+_MARK_END = "\x03"
+
+
+def build_match_query(q: str) -> str | None:
+    """Turn free text into a safe FTS5 query: every word quoted, all words required."""
+    words = re.findall(r"\w+", q)
+    if not words:
+        return None
+    # quoting stops user input from being parsed as FTS5 syntax (NEAR, OR, column filters...)
+    # the last word gets a * so results show up while the user is still typing it
+    quoted = [f'"{word}"' for word in words]
+    quoted[-1] += "*"
+    return " ".join(quoted)
+
+
+def _highlight(snippet: str) -> str:
+    return str(escape(snippet)).replace(_MARK_START, "<mark>").replace(_MARK_END, "</mark>")
+
+
+async def search_posts(db: AsyncSession, q: str, cursor: str | None, limit: int) -> PostSearchPage:
+    """Run a bm25 ranked search, one keyset page at a time (ordered by rank, then id)."""
+    match = build_match_query(q)
+    if match is None:
+        return PostSearchPage(results=[], next_cursor=None)
+
+    # rank first, on the index alone: bm25 for every match, then the cursor and the limit.
+    # snippet() is the expensive part (it re-tokenizes the content), so it only runs for the
+    # rows of this page, in the outer query. the LIMIT stops SQLite from flattening the two
+    ranked = (
+        select(
+            posts_fts.c.rowid.label("post_id"),
+            func.bm25(_fts, settings.search_title_weight, 1.0).label("rank"),  # lower is better
+        )
+        .where(_fts.match(match))
+        .subquery()
+    )
+    page = select(ranked.c.post_id, ranked.c.rank)
+
+    if cursor is not None:
+        try:
+            rank, post_id = decode_key(cursor)
+            rank, post_id = float(rank), int(post_id)
+        except (ValueError, TypeError):
+            raise invalid_cursor()
+        page = page.where(tuple_(ranked.c.rank, ranked.c.post_id) > tuple_(rank, post_id))
+
+    page = (
+        page.order_by(ranked.c.rank, ranked.c.post_id)
+        .limit(limit + 1)  # lookahead row, same trick as the feeds
+        .subquery()
+    )
+
+    query = (
+        select(
+            page.c.post_id,
+            page.c.rank,
+            # auxiliary functions need the MATCH in their own query, the rowid join makes
+            # it a direct lookup per page row
+            func.snippet(_fts, 1, _MARK_START, _MARK_END, "…", settings.search_snippet_tokens).label("snippet"),
+            models.Post.title,
+            models.Post.user_id,
+            models.Post.date_posted,
+            *AUTHOR_COLUMNS,
+        )
+        .select_from(page)
+        .join(posts_fts, posts_fts.c.rowid == page.c.post_id)
+        .join(models.Post, models.Post.id == page.c.post_id)
+        .join(models.User, models.User.id == models.Post.user_id)
+        .where(_fts.match(match))
+        .order_by(page.c.rank, page.c.post_id)
+    )
+
+    rows = (await db.execute(query)).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_key([rows[-1].rank, rows[-1].post_id])
+
+    return PostSearchPage(
+        results=[
+            PostSearchResult(
+                id=row.post_id,
+                title=row.title,
+                snippet=_highlight(row.snippet),
+                user_id=row.user_id,
+                date_posted=row.date_posted,
+                author=UserPublic(**author_from_row(row)),
+            )
+            for row in rows
+        ],
+        next_cursor=next_cursor,
+    )
+
+
+async def _rebuild() -> None:
+    async with engine.begin() as conn:
+        await conn.run_sync(rebuild_search_index)
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    # python -m search rebuild
+    if sys.argv[1:] != ["rebuild"]:
+        sys.exit("usage: python -m search rebuild")
+    asyncio.run(_rebuild())
+    print("search index rebuilt")
@@ -0,0 +1,96 @@
+# SLOW QUERY LOG
+# every statement that takes longer than settings.slow_query_ms is logged (logger
+# "blog.slow_queries") and kept in a small ring buffer served at /debug/slow-queries.
+# an entry has the SQL, the shape of its parameters (names and types, never the values:
+# they can be password hashes and emails), the duration and the route that ran it.
+#
+# the route gets to the connection in two hops: get_db / get_read_db put it in
+# session.info, and when the session begins a transaction it's copied to connection.info,
+# which the cursor events can see
+
+import logging
+import re
+import time
+from collections import deque
+from dataclasses import dataclass
+from datetime import UTC, datetime
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from config import settings
+
+logger = logging.getLogger("blog.slow_queries")
+
+
+@dataclass
+class SlowQuery:
+    at: datetime
+    duration_ms: float
+    route: str | None  # None for queries outside a request (startup, CLI, exports)
+    statement: str
+    parameters: str
+
+
+recent: deque[SlowQuery] = deque(maxlen=settings.slow_query_log_size)
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def _shape(parameters) -> str:
+    # "{title: str, user_id: int}" or "(int, str)", the values never leave the database
+    if isinstance(parameters, dict):
+        return "{" + ", ".join(f"{key}: {type(value).__name__}" for key, value in parameters.items()) + "}"
+    if isinstance(parameters, (list, tuple)):
+        return "(" + ", ".join(type(value).__name__ for value in parameters) + ")"
+    return type(parameters).__name__
+
+
+def parameters_shape(parameters, executemany: bool) -> str:
+    """Describe the parameters of a statement without their values."""
+    if executemany:
+        # bulk inserts run one statement for many rows, the row count is what matters
+        first = parameters[0] if parameters else ()
+        return f"{len(parameters)} x {_shape(first)}"
+    return _shape(parameters)
+
+
+def instrument_slow_queries(async_engine) -> None:
+    """Record statements on this engine that run longer than settings.slow_query_ms."""
+    threshold = settings.slow_query_ms / 1000
+
+    @event.listens_for(async_engine.sync_engine, "before_cursor_execute")
+    def _before(conn, _cursor, _statement, _parameters, _context, _executemany):
+        conn.info.setdefault("slow_query_started", []).append(time.perf_counter())
+
+    @event.listens_for(async_engine.sync_engine, "after_cursor_execute")
+    def _after(conn, _cursor, statement, parameters, _context, executemany):
+        elapsed = time.perf_counter() - conn.info["slow_query_started"].pop()
+        if elapsed < threshold:
+            return
+        entry = SlowQuery(
+            at=datetime.now(UTC),
+            duration_ms=round(elapsed * 1000, 2),
+            route=conn.info.get("route"),
+            statement=_WHITESPACE.sub(" ", statement).strip()[:2000],
+            parameters=parameters_shape(parameters, executemany),
+        )
+        recent.append(entry)
+        logger.warning(
+            "slow query: %.1f ms on %s: %s params=%s",
+            entry.duration_ms,
+            entry.route or "<no route>",
+            entry.statement,
+            entry.parameters,
+        )
+
+    @event.listens_for(async_engine.sync_engine, "checkin")  # pool event, registered through the engine
+    def _forget_route(_dbapi_connection, connection_record):
+        # pooled connections outlive the request, don't blame the next user of this one
+        connection_record.info.pop("route", None)
+
+
+# sessions from every sessionmaker (writer and reader) are plain Sessions underneath
+@event.listens_for(Session, "after_begin")
+def _copy_route_to_connection(session, _transaction, connection):
+    connection.info["route"] = session.info.get("route")
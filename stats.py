@@ -0,0 +1,94 @@
+# DENORMALIZED PER-USER STATISTICS
+# post_count, last_posted_at and total_chars live on the users row and are updated in the
+# same transaction as the post write that changes them, so profile pages read them in O(1)
+# instead of running COUNT/MAX/SUM over posts.
+# deleting a user needs nothing extra, the counters go away with the row.
+#
+# if they ever drift (manual SQL, a crash mid deploy...): python -m stats repair
+
+import asyncio
+import sys
+
+from sqlalchemy import func, inspect, select, text, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import models
+from database import engine
+
+
+def _latest_post_date(user_id: int):
+    # served by the (user_id, date_posted, id) index, a single seek no matter how many posts
+    return (
+        select(func.max(models.Post.date_posted))
+        .where(models.Post.user_id == user_id)
+        .scalar_subquery()
+    )
+
+
+async def apply_post_stats(
+    db: AsyncSession,
+    user_id: int,
+    post_delta: int = 0,
+    chars_delta: int = 0,
+) -> None:
+    """Adjust a user's counters, call it after the post write is flushed and before commit."""
+    await db.execute(
+        update(models.User)
+        .where(models.User.id == user_id)
+        .values(
+            post_count=models.User.post_count + post_delta,
+            total_chars=models.User.total_chars + chars_delta,
+            last_posted_at=_latest_post_date(user_id),
+        ),
+    )
+
+
+STATS_COLUMNS = {
+    "post_count": "INTEGER NOT NULL DEFAULT 0",
+    "last_posted_at": "DATETIME",
+    "total_chars": "INTEGER NOT NULL DEFAULT 0",
+}
+
+
+def repair_user_stats(connection) -> None:
+    """Recompute every user's counters in one grouped pass over posts (sync connection)."""
+    # databases created before these columns existed get them added first
+    existing = {column["name"] for column in inspect(connection).get_columns("users")}
+    for name, ddl in STATS_COLUMNS.items():
+        if name not in existing:
+            connection.execute(text(f"ALTER TABLE users ADD COLUMN {name} {ddl}"))
+
+    connection.execute(text("UPDATE users SET post_count = 0, last_posted_at = NULL, total_chars = 0"))
+    connection.execute(
+        text(
+            """
+            UPDATE users
+            SET post_count = agg.post_count,
+                last_posted_at = agg.last_posted_at,
+                total_chars = agg.total_chars
+            FROM (
+                SELECT user_id,
+                       count(*) AS post_count,
+                       max(date_posted) AS last_posted_at,
+                       sum(length(content)) AS total_chars
+                FROM posts
+                GROUP BY user_id
+            ) AS agg
+            WHERE agg.user_id = users.id
+            """,
+        ),
+    )
+
+
+async def _repair() -> None:
+    async with engine.begin() as conn:
+        await conn.run_sync(repair_user_stats)
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    # python -m stats repair
+    if sys.argv[1:] != ["repair"]:
+        sys.exit("usage: python -m stats repair")
+    asyncio.run(_repair())
+    print("user stats recomputed")
@@ -0,0 +1,73 @@
+# STREAMING TEMPLATE RENDERING
+# the feed pages used to be rendered into one string before the first byte went out, so
+# time to first byte and memory grew with the page. here templates render on an async
+# jinja2 environment and every chunk is sent as it's produced: the layout's <head> goes
+# out before the posts query even starts (the browser fetches css/js meanwhile), then the
+# post rows are rendered one by one as they come off a server side cursor.
+#
+# the layout calls {{ stream_flush() }} where the head ends. on the streaming environment
+# that yields FLUSH, which iter_template swallows and turns into "send what we have now".
+# everywhere else output is coalesced into stream_chunk_size pieces, one ASGI message per
+# jinja expression would cost more than it saves
+
+from collections.abc import AsyncIterator
+
+from jinja2 import Template
+from markupsafe import Markup
+from sqlalchemy import Select
+
+from config import settings
+from database import ReadSessionLocal
+from feeds import summary_from_row
+from pagination import encode_cursor
+
+FLUSH = Markup("<!--stream-flush-->")  # an html comment, harmless if it ever got through
+
+
+class PostStream:
+    """Post summaries for a template's for loop, pulled from the database while it renders.
+
+    next_cursor is only known once the loop is done (it needs the lookahead row), so
+    templates read it after the loop.
+    """
+
+    def __init__(self, query: Select, limit: int):
+        self.query = query  # already through paginate_posts, so limit + 1 rows at most
+        self.limit = limit
+        self.next_cursor: str | None = None
+
+    async def __aiter__(self):
+        # own session, like exports.py: the rows are read while the response is being sent,
+        # after the request scoped one may already be closed
+        async with ReadSessionLocal() as session:
+            result = await session.stream(self.query.execution_options(yield_per=self.limit + 1))
+            last = None
+            count = 0
+            async for row in result:
+                if count == self.limit:  # the lookahead row, there is a next page
+                    self.next_cursor = encode_cursor(last.date_posted, last.id)
+                    break
+                count += 1
+                last = row
+                yield summary_from_row(row)
+
+
+async def iter_template(template: Template, context: dict) -> AsyncIterator[bytes]:
+    """Render a template on the async environment as a stream of encoded chunks."""
+    buffer: list[str] = []
+    size = 0
+    async for event in template.generate_async(context):
+        if event == FLUSH:
+            if buffer:
+                yield "".join(buffer).encode()
+                buffer.clear()
+                size = 0
+            continue
+        buffer.append(event)
+        size += len(event)
+        if size >= settings.stream_chunk_size:
+            yield "".join(buffer).encode()
+            buffer.clear()
+            size = 0
+    if buffer:
+        yield "".join(buffer).encode()
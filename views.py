@@ -0,0 +1,109 @@
+# WRITE-BEHIND VIEW COUNTERS
+# counting a view with an UPDATE per request would put every page view behind the single
+# SQLite writer (and turn cached reads back into writes). instead views are added up in a
+# dict per post id, in memory, and a background task started in main.lifespan writes them
+# out every views_flush_interval_seconds as one batched UPDATE ... SET view_count =
+# view_count + ? per post, in a single transaction. shutdown flushes whatever is left.
+#
+# the increments are relative, so several workers flushing their own buffers still add up
+# correctly. what a crash loses is at most one interval of views, which is the trade.
+# counts shown by the api and the post page are the flushed ones, as of when the post was
+# cached. a flush leaves post_cache and page_cache alone: the posts it touches are the
+# most read ones, exactly what those caches are for, and dropping them (and bumping the
+# cache generation under renders in flight) every interval would undo them. so a shown
+# count can lag by up to the flush interval plus the cache ttl, or less if the post is
+# edited in between
+
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+
+from sqlalchemy import bindparam, update
+
+import models
+from config import settings
+from database import engine
+
+logger = logging.getLogger("blog.views")
+
+
+@dataclass
+class ViewStats:
+    recorded: int = 0  # views counted in memory
+    flushed: int = 0  # views written to the database
+    flushes: int = 0  # batched UPDATE transactions
+    errors: int = 0  # failed flushes, their views are put back and retried next time
+    flush_seconds_total: float = 0.0
+
+
+class ViewCounter:
+    """Per post view increments, buffered in memory and flushed in batches."""
+
+    def __init__(self):
+        self.stats = ViewStats()
+        self._pending: dict[int, int] = {}
+        self._lock = asyncio.Lock()  # one flush at a time (the timer and shutdown can overlap)
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def record(self, post_id: int) -> None:
+        # only called for posts that exist, so the dict is bounded by the number of posts
+        self._pending[post_id] = self._pending.get(post_id, 0) + 1
+        self.stats.recorded += 1
+
+    async def flush(self) -> int:
+        """Write the buffered increments out, returns the number of posts updated."""
+        async with self._lock:
+            if not self._pending:
+                return 0
+            # swap the buffer first, views recorded while we await land in the new one
+            batch, self._pending = self._pending, {}
+            started = time.perf_counter()
+            try:
+                async with engine.begin() as conn:
+                    await conn.execute(
+                        update(models.Post.__table__)
+                        .where(models.Post.__table__.c.id == bindparam("post_id"))
+                        .values(view_count=models.Post.__table__.c.view_count + bindparam("views")),
+                        [{"post_id": post_id, "views": views} for post_id, views in sorted(batch.items())],
+                    )
+            except Exception:
+                # put the views back for the next attempt instead of losing them
+                for post_id, views in batch.items():
+                    self._pending[post_id] = self._pending.get(post_id, 0) + views
+                self.stats.errors += 1
+                logger.exception("flushing %d view counters failed", len(batch))
+                return 0
+
+            self.stats.flushes += 1
+            self.stats.flushed += sum(batch.values())
+            self.stats.flush_seconds_total += time.perf_counter() - started
+            return len(batch)
+
+    async def run(self, interval: float) -> None:
+        """Flush every interval seconds until cancelled (started by main.lifespan)."""
+        while True:
+            await asyncio.sleep(interval)
+            await self.flush()
+
+
+view_counter = ViewCounter()
+
+
+def start_flusher() -> asyncio.Task:
+    return asyncio.create_task(view_counter.run(settings.views_flush_interval_seconds))
+
+
+async def stop_flusher(task: asyncio.Task) -> None:
+    """Stop the timer and write out whatever is still buffered."""
+    # cancelled while holding the lock, so never halfway through a flush with its batch
+    # already swapped out (it's either sleeping or waiting for the lock)
+    async with view_counter._lock:
+        task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+    await view_counter.flush()